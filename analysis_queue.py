@@ -0,0 +1,376 @@
+import asyncio
+import sqlite3
+import time
+from collections import Counter
+
+# --- OVERFLOW POLICIES ---
+DROP_OLDEST = "drop_oldest"          # Evict the oldest queued message to make room
+DROP_NEWEST = "drop_newest"          # Reject the incoming message
+SAMPLE_PER_USER = "sample_per_user"  # Evict the oldest message of whoever has the most queued
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, SAMPLE_PER_USER)
+
+
+# --- RATE LIMITER ---
+class TokenBucket:
+    """
+    Token bucket shared by every analysis worker.
+    Refills at `rate_per_minute` tokens per minute and holds at most `capacity` tokens.
+    """
+    def __init__(self, rate_per_minute: float, capacity: float = 1.0):
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute must be positive")
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, float(capacity))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _take(self, tokens: float) -> bool:
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Takes tokens if they are available right now, without waiting or jumping the queue."""
+        return not self._lock.locked() and self._take(tokens)
+
+    async def acquire(self, tokens: float = 1.0):
+        """Waits until tokens are available. Waiters are served in arrival order."""
+        async with self._lock:
+            while not self._take(tokens):
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def refund(self, tokens: float = 1.0):
+        """Gives back tokens taken for a request that was never sent."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + tokens)
+
+
+# --- BOUNDED QUEUE ---
+class AnalysisQueue(asyncio.Queue):
+    """
+    Bounded queue of (user_id, message_content, guild_id) items; retried items carry
+    a fourth field with the number of failed attempts.
+    When full, put_nowait applies the overflow policy instead of raising QueueFull.
+    Workers ack() items once their analysis is stored, or nack() them to retry.
+    """
+    def __init__(self, maxsize: int, policy: str = DROP_OLDEST, max_attempts: int = 3):
+        if maxsize <= 0:
+            raise ValueError("AnalysisQueue must be bounded")
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{policy}'. Expected one of {OVERFLOW_POLICIES}.")
+        super().__init__(maxsize=maxsize)
+        self.policy = policy
+        self.max_attempts = max_attempts
+        self.dropped = 0
+        self.processed = 0
+        self.retried = 0
+        self._per_user = Counter()
+
+    # asyncio.Queue storage hooks, extended to track queued messages per user
+    def _put(self, item):
+        super()._put(item)
+        self._per_user[item[0]] += 1
+
+    def _get(self):
+        item = super()._get()
+        self._forget(item)
+        return item
+
+    def _forget(self, item):
+        user_id = item[0]
+        self._per_user[user_id] -= 1
+        if self._per_user[user_id] <= 0:
+            del self._per_user[user_id]
+
+    def _evict_oldest(self, user_id=None):
+        """Removes the oldest queued item, or the oldest one from `user_id`."""
+        if user_id is None:
+            index = 0
+        else:
+            index = next(i for i, queued_item in enumerate(self._queue) if queued_item[0] == user_id)
+        item = self._queue[index]
+        del self._queue[index]
+        self._forget(item)
+        asyncio.Queue.task_done(self)  # The evicted item will never be processed
+        return item
+
+    def put_nowait(self, item):
+        """
+        Enqueues the item, applying the overflow policy when full.
+        Returns the dropped item (possibly `item` itself), or None if nothing was dropped.
+        """
+        dropped = None
+        if self.full():
+            if self.policy == DROP_NEWEST:
+                self.dropped += 1
+                return item
+            if self.policy == DROP_OLDEST:
+                dropped = self._evict_oldest()
+            else:
+                heaviest, queued = self._per_user.most_common(1)[0]
+                if self._per_user.get(item[0], 0) + 1 >= queued:
+                    # The sender already holds the largest share; sample them down instead
+                    self.dropped += 1
+                    return item
+                dropped = self._evict_oldest(heaviest)
+            self.dropped += 1
+        super().put_nowait(item)
+        return dropped
+
+    def task_done(self):
+        super().task_done()
+        self.processed += 1
+
+    # --- Acknowledgement ---
+    def ack(self, items: list):
+        """Marks items as durably handled. In-memory queues have nothing to release."""
+
+    def nack(self, items: list):
+        """Requeues items whose analysis failed, until they have used up max_attempts."""
+        for item in items:
+            attempts = (item[3] if len(item) > 3 else 0) + 1
+            self._release(item)
+            if attempts >= self.max_attempts:
+                self.dropped += 1
+                continue
+            self.retried += 1
+            self.put_nowait((item[0], item[1], item[2], attempts))
+
+    def requeue(self, items: list):
+        """Requeues items without counting an attempt, for failures that were not theirs (an outage, say)."""
+        for item in items:
+            self._release(item)
+            self.retried += 1
+            self.put_nowait(item)
+
+    def _release(self, item):
+        """Forgets any bookkeeping held for a dequeued item."""
+
+    def restore(self) -> int:
+        """Reloads a persisted backlog. Returns how many items were restored."""
+        return 0
+
+    def close(self):
+        """Persists what is still queued, where supported."""
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.qsize(),
+            "maxsize": self.maxsize,
+            "policy": self.policy,
+            "dropped": self.dropped,
+            "processed": self.processed,
+            "retried": self.retried,
+        }
+
+
+# --- DISK-SPILLING QUEUE ---
+class SpillingAnalysisQueue(AnalysisQueue):
+    """
+    AnalysisQueue with an in-memory head of at most `memory_size` items and an
+    append-only SQLite log behind it, so bursts cost disk rather than RAM.
+
+    Once anything has spilled, new items also go to disk to keep FIFO order; the head
+    is refilled from the log as it drains. Spilled items are buffered and inserted
+    `spill_batch` at a time (or at the next commit), so on_message does not pay for
+    an INSERT per message. Spilled rows are only deleted on ack(), so a crash replays
+    them (at-least-once). restore() picks the log back up on startup.
+
+    Items that never left memory are written to the log only by close(), on a clean
+    shutdown, together with any that are in flight. A hard crash therefore loses the
+    memory head (up to `memory_size` items) and spilled items not yet inserted (at most
+    `spill_batch`, or `commit_interval` seconds' worth).
+    """
+    def __init__(self, path: str, maxsize: int, memory_size: int, policy: str = DROP_OLDEST,
+                 max_attempts: int = 3, commit_every: int = 200, commit_interval: float = 1.0,
+                 spill_batch: int = 100):
+        super().__init__(maxsize=maxsize, policy=policy, max_attempts=max_attempts)
+        self.path = path
+        self.memory_size = memory_size
+        self.refill_size = max(1, memory_size // 2)
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.spill_batch = spill_batch
+        self._spilled = 0          # Spilled items not yet loaded into memory, buffered ones included
+        self._spill_buffer = []    # Spilled items waiting to be inserted
+        self._restoring = False
+        self._loaded_up_to = 0     # Highest row id loaded into memory
+        self._row_ids = {}         # id(item) -> row id, for items loaded from disk
+        self._in_flight = {}       # id(item) -> item, dequeued but not yet acked
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS analysis_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                guild_id INTEGER
+            )
+        """)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(analysis_log)")]
+        if "guild_id" not in columns:  # Logs written before messages were tracked per guild
+            self.conn.execute("ALTER TABLE analysis_log ADD COLUMN guild_id INTEGER")
+        self.conn.commit()
+
+    # --- Log helpers ---
+    def _after_write(self, writes: int = 1):
+        self._uncommitted += writes
+        if self._uncommitted >= self.commit_every or time.monotonic() - self._last_commit >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        self._write_spill_buffer()
+        if self._uncommitted:
+            self.conn.commit()
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+
+    def _insert(self, items: list):
+        self.conn.executemany(
+            "INSERT INTO analysis_log (user_id, content, guild_id, attempts) VALUES (?, ?, ?, ?)",
+            [(item[0], item[1], item[2], item[3] if len(item) > 3 else 0) for item in items]
+        )
+        self._uncommitted += len(items)
+
+    def _write_spill_buffer(self):
+        """Inserts the buffered spilled items. Must run before anything reads the log."""
+        if self._spill_buffer:
+            self._insert(self._spill_buffer)
+            self._spill_buffer = []
+
+    def _delete_rows(self, row_ids: list):
+        if row_ids:
+            self.conn.executemany("DELETE FROM analysis_log WHERE id = ?", [(row_id,) for row_id in row_ids])
+            self._after_write(len(row_ids))
+
+    def _refill(self):
+        self._write_spill_buffer()
+        rows = self.conn.execute(
+            "SELECT id, user_id, content, guild_id, attempts FROM analysis_log WHERE id > ? ORDER BY id LIMIT ?",
+            (self._loaded_up_to, self.refill_size)
+        ).fetchall()
+        for row_id, user_id, content, guild_id, attempts in rows:
+            item = (user_id, content, guild_id, attempts) if attempts else (user_id, content, guild_id)
+            self._row_ids[id(item)] = row_id
+            self._queue.append(item)  # Already counted in _per_user when it was spilled
+            self._loaded_up_to = row_id
+        self._spilled -= len(rows)
+
+    # --- asyncio.Queue storage hooks ---
+    def qsize(self):
+        return len(self._queue) + self._spilled
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def _put(self, item):
+        if self._restoring:
+            # restore() re-counts a row that is already in the log
+            self._spilled += 1
+            self._per_user[item[0]] += 1
+        elif self._spilled or len(self._queue) >= self.memory_size:
+            self._spill_buffer.append(item)
+            self._spilled += 1
+            self._per_user[item[0]] += 1
+            if len(self._spill_buffer) >= self.spill_batch:
+                self._write_spill_buffer()
+            self._after_write(0)
+        else:
+            super()._put(item)
+
+    def _get(self):
+        if not self._queue:
+            self._refill()
+        item = super()._get()
+        self._in_flight[id(item)] = item
+        return item
+
+    def _evict_oldest(self, user_id=None):
+        # The memory head is always older than anything on disk
+        if self._queue and (user_id is None or any(queued_item[0] == user_id for queued_item in self._queue)):
+            item = super()._evict_oldest(user_id)
+            self._release(item)
+            return item
+        self._write_spill_buffer()
+        query = "SELECT id, user_id, content, guild_id FROM analysis_log WHERE id > ?"
+        params = [self._loaded_up_to]
+        if user_id is not None:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        row_id, row_user_id, content, guild_id = self.conn.execute(query + " ORDER BY id LIMIT 1", params).fetchone()
+        self._delete_rows([row_id])
+        self._spilled -= 1
+        item = (row_user_id, content, guild_id)
+        self._forget(item)
+        asyncio.Queue.task_done(self)
+        return item
+
+    # --- Acknowledgement ---
+    def ack(self, items: list):
+        row_ids = []
+        for item in items:
+            self._in_flight.pop(id(item), None)
+            row_id = self._row_ids.pop(id(item), None)
+            if row_id:
+                row_ids.append(row_id)
+        self._delete_rows(row_ids)
+
+    def _release(self, item):
+        self._in_flight.pop(id(item), None)
+        row_id = self._row_ids.pop(id(item), None)
+        if row_id:
+            self._delete_rows([row_id])
+
+    # --- Persistence across restarts ---
+    def restore(self) -> int:
+        """
+        Re-queues the rows left by a previous run. Call it once, before anything else is queued.
+        Each row goes through put_nowait, so task accounting and the overflow policy apply as
+        usual; only its user id is needed, as the content stays on disk until _refill loads it.
+        """
+        self.commit()
+        rows = self.conn.execute("SELECT id, user_id FROM analysis_log WHERE id > ? ORDER BY id",
+                                 (self._loaded_up_to,)).fetchall()
+        dropped_before = self.dropped
+        self._restoring = True
+        try:
+            for row_id, user_id in rows:
+                placeholder = (user_id, None, None)
+                if self.put_nowait(placeholder) is placeholder:
+                    self._delete_rows([row_id])  # Over capacity and rejected by the overflow policy
+        finally:
+            self._restoring = False
+        self.commit()
+        return len(rows) - (self.dropped - dropped_before)
+
+    def close(self):
+        """Writes in-flight and memory-only items to the log, then commits and closes it."""
+        if self.conn is None:
+            return
+        unsaved = [item for item in list(self._in_flight.values()) + list(self._queue) if id(item) not in self._row_ids]
+        persisted = len(unsaved) + len(self._spill_buffer)
+        if unsaved:
+            self._insert(unsaved)  # Ahead of the buffered items, which are newer
+        self.commit()
+        self.conn.close()
+        self.conn = None
+        print(f"Analysis queue: persisted {persisted} item(s); {len(unsaved) + len(self._row_ids) + self._spilled} await replay.")
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["in_memory"] = len(self._queue)
+        stats["spilled"] = self._spilled
+        return stats
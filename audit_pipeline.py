@@ -0,0 +1,88 @@
+import asyncio
+import os
+
+import gemini_client
+
+# --- CONSTANTS ---
+AUDIT_CHUNK_TOKENS = int(os.getenv('AUDIT_CHUNK_TOKENS', '3000'))          # Token budget per map prompt
+AUDIT_MAP_CONCURRENCY = int(os.getenv('AUDIT_MAP_CONCURRENCY', '4'))       # Chunk summaries in flight per audit
+AUDIT_MAX_PARTIALS = int(os.getenv('AUDIT_MAX_PARTIALS', '12'))            # Rolling summaries kept per channel
+CHARS_PER_TOKEN = 4                                                         # Rough estimate, good enough for budgeting
+
+# Audit state per channel, as stored by database_utils:
+# {
+#     "last_message_id": str,   # Newest message already summarized
+#     "partials": [{"summary": str, "message_count": int, "last_ts": float}, ...],  # Oldest first
+#     "report": str | None      # Last reduced report, reused while nothing new arrives
+# }
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def chunk_messages(messages: list[str], token_budget: int = AUDIT_CHUNK_TOKENS) -> list[list[str]]:
+    """Splits messages, in order, into chunks whose estimated size fits the token budget."""
+    chunks, current, current_tokens = [], [], 0
+    for message in messages:
+        # A single oversized message is truncated rather than blowing the budget
+        message = message[:token_budget * CHARS_PER_TOKEN]
+        tokens = estimate_tokens(message)
+        if current and current_tokens + tokens > token_budget:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(message)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+# --- MAP ---
+async def summarize_chunk(chunk: list[str]) -> str:
+    message_log = "\n".join(chunk)
+    prompt = (
+        "You are a sub-routine condensing a segment of a chat log for a later report. "
+        "Summarize the dominant topics, the overall tone, any conflicts or dissent, and notable behavioral patterns. "
+        "Be factual and concise, under 150 words. Do not add any preamble.\n"
+        f"Here is the segment:\n\n---\n\n{message_log}\n\n---"
+    )
+    response = await gemini_client.generate("audit_map", prompt)
+    return response.text.strip()
+
+
+async def map_chunks(chunks: list[list[str]], concurrency: int = AUDIT_MAP_CONCURRENCY) -> list[str]:
+    """Summarizes chunks in parallel, at most `concurrency` at a time. Order is preserved."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(chunk):
+        async with semaphore:
+            return await summarize_chunk(chunk)
+
+    return await asyncio.gather(*(run(chunk) for chunk in chunks))
+
+
+# --- REDUCE ---
+async def compact_partials(partials: list[dict], max_partials: int = AUDIT_MAX_PARTIALS) -> list[dict]:
+    """Merges the oldest partial summaries into one so the rolling state stays bounded."""
+    if len(partials) <= max_partials:
+        return partials
+    overflow = len(partials) - max_partials + 1
+    oldest, rest = partials[:overflow], partials[overflow:]
+    merged = await summarize_chunk([p["summary"] for p in oldest])
+    return [{
+        "summary": merged,
+        "message_count": sum(p["message_count"] for p in oldest),
+        "last_ts": oldest[-1]["last_ts"]
+    }] + rest
+
+
+async def reduce_partials(partials: list[dict]) -> str:
+    summaries = "\n\n".join(f"[Segment {i + 1}] {p['summary']}" for i, p in enumerate(partials))
+    prompt = (
+        "Your name is 'Sai', a superior AI with an Ultron-like persona. "
+        "The communication log has been condensed into chronological segment summaries. "
+        f"Here they are:\n\n---\n\n{summaries}\n\n---"
+    )
+    response = await gemini_client.generate("audit_reduce", prompt)
+    return response.text
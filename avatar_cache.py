@@ -0,0 +1,144 @@
+import asyncio
+import os
+import re
+from collections import OrderedDict
+
+# Discord avatar URLs embed the avatar hash, so a hash never points at different pixels.
+# Entries are therefore never revalidated, only evicted for space.
+
+
+class AvatarCache:
+    """
+    Two-tier cache of pre-resized avatars (raw 128x128 RGBA bytes), keyed by avatar hash.
+    Tier 1 is an in-memory LRU capped by entry count.
+    Tier 2 is a directory of files capped by total bytes, evicting least recently used first.
+    """
+    def __init__(self, directory: str, memory_entries: int, disk_max_bytes: int):
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._disk_index = OrderedDict()  # key -> file size, least recently used first
+        self._disk_bytes = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.rgba")
+
+    @staticmethod
+    def _safe_key(key: str) -> str:
+        return re.sub(r"[^A-Za-z0-9_]", "_", str(key))
+
+    # --- Internal BLOCKING functions ---
+
+    def _scan_disk_sync(self):
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                # Left behind by a write interrupted before its rename
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            if not name.endswith(".rgba"):
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name[:-len(".rgba")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk_index[key] = size
+            self._disk_bytes += size
+
+    def _read_sync(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # Keeps mtime usable as recency across restarts
+            return data
+        except OSError:
+            return None
+
+    def _write_sync(self, key: str, data: bytes):
+        path = self._path(key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _remove_sync(self, keys: list):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    # --- Public ASYNC functions ---
+
+    async def load(self):
+        """Indexes the files already on disk from previous runs and removes unfinished writes."""
+        await asyncio.to_thread(self._scan_disk_sync)
+        print(f"Avatar cache: {len(self._disk_index)} avatar(s) on disk ({self._disk_bytes / 1024:.0f} KiB).")
+
+    def _remember(self, key: str, data: bytes):
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> bytes | None:
+        key = self._safe_key(key)
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return data
+
+        if key in self._disk_index:
+            data = await asyncio.to_thread(self._read_sync, key)
+            if data is not None:
+                self._disk_index.move_to_end(key)
+                self._remember(key, data)
+                self.disk_hits += 1
+                return data
+            self._disk_bytes -= self._disk_index.pop(key, 0)
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, data: bytes):
+        key = self._safe_key(key)
+        self._remember(key, data)
+        if len(data) > self.disk_max_bytes:
+            return
+
+        try:
+            await asyncio.to_thread(self._write_sync, key, data)
+        except OSError as e:
+            print(f"Avatar cache write error: {e}")
+            return
+
+        self._disk_bytes += len(data) - self._disk_index.pop(key, 0)
+        self._disk_index[key] = len(data)
+
+        evicted = []
+        while self._disk_bytes > self.disk_max_bytes:
+            old_key, size = self._disk_index.popitem(last=False)
+            self._disk_bytes -= size
+            evicted.append(old_key)
+        if evicted:
+            await asyncio.to_thread(self._remove_sync, evicted)
+
+    def stats(self) -> dict:
+        return {
+            "memory_entries": len(self._memory),
+            "disk_entries": len(self._disk_index),
+            "disk_bytes": self._disk_bytes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,543 @@
+"""
+End-to-end throughput benchmark.
+
+Drives the real handlers (MyBot.on_message -> analysis_queue -> analysis_worker -> database_utils,
+and CommandsCog.profile) with synthetic messages and interactions. Discord and Gemini are replaced
+by in-process stand-ins and storage by a local backend, so nothing touches the network.
+
+    python benchmark.py --messages 5000 --users 200 --gemini-latency 0.4 --workers 4
+    python benchmark.py --profiles 500 --output bench_output.txt
+    python benchmark.py --messages 0 --profiles 0 --asks 200
+
+Reports ingest/analysis throughput, queue depth over time and p50/p90/p99 latency per stage.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from io import BytesIO
+from types import SimpleNamespace
+
+import metrics
+from storage_backend import SCORE_KEYS, StorageBackend
+
+
+# --- STAND-INS ---
+class FakeGeminiModel:
+    """Answers analysis, designation and free-text prompts after a configurable delay."""
+    def __init__(self, latency: float, jitter: float, failure_rate: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.error_rate = error_rate
+        self.calls = 0
+        self.timings = []
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        self.calls += 1
+        started = time.perf_counter()
+        latency = max(0.0, random.gauss(self.latency, self.jitter))
+        # A stream starts after a fraction of the latency and spreads the rest over its chunks
+        await asyncio.sleep(latency * 0.2 if stream else latency)
+        self.timings.append(time.perf_counter() - started)
+        if random.random() < self.error_rate:
+            raise FakeServerError("503 The model is overloaded.")
+
+        if "Return a JSON array" in prompt:
+            indices = [int(i) for i in re.findall(r"^(\d+): ", prompt, flags=re.MULTILINE)]
+            items = [{"index": i, **{key: round(random.random(), 2) for key in SCORE_KEYS}} for i in indices]
+            text = json.dumps(items)
+            if random.random() < self.failure_rate:
+                text = text[:len(text) // 2]  # Truncated output, exercises the parse failure path
+        elif "'Designation'" in prompt:
+            text = random.choice(["Volatile Agitator", "Docile Unit", "Neutral Observer", "Erratic Drone"])
+        else:
+            text = "Your patterns are... predictable. " * 40
+        if stream:
+            return FakeStream(text, chunks=8, delay=latency * 0.8 / 8)
+        return SimpleNamespace(text=text)
+
+
+class FakeServerError(Exception):
+    """Carries an HTTP status the way google.api_core errors do, so it is retried."""
+    code = 503
+
+
+class FakeStream:
+    """Async iterable of response chunks, like a streamed generate_content_async response."""
+    def __init__(self, text: str, chunks: int, delay: float):
+        size = -(-len(text) // chunks)
+        self.parts = [text[i:i + size] for i in range(0, len(text), size)]
+        self.delay = delay
+
+    async def __aiter__(self):
+        for i, part in enumerate(self.parts):
+            if i:
+                await asyncio.sleep(self.delay)
+            yield SimpleNamespace(text=part)
+
+
+class MemoryBackend(StorageBackend):
+    """Dict-backed storage that isolates the bot's own overhead from any database."""
+    name = "memory"
+
+    def __init__(self):
+        self.users = {}
+        self.audits = {}
+        self.members = {}       # (guild_id, user_id) -> member record
+        self.guild_totals = {}
+        self.leaderboards = {}
+
+    def _user(self, user_id):
+        return self.users.setdefault(str(user_id), {"message_count": 0, "analysis_count": 0})
+
+    def _member(self, guild_id, user_id):
+        return self.members.setdefault((str(guild_id), str(user_id)), {"message_count": 0, "analysis_count": 0})
+
+    def _totals(self, guild_id):
+        return self.guild_totals.setdefault(str(guild_id), {"message_count": 0, "analysis_count": 0})
+
+    def increment_message_counts(self, pending):
+        for (user_id, server_id), increment in pending.items():
+            user = self._user(user_id)
+            user["server_id"] = server_id
+            user["message_count"] += increment
+            self._member(server_id, user_id)["message_count"] += increment
+            self._totals(server_id)["message_count"] += increment
+        pending.clear()
+
+    def get_user_profile(self, user_id):
+        user = self.users.get(str(user_id))
+        return json.loads(json.dumps(user)) if user else None
+
+    def set_user_motto(self, user_id, server_id, motto):
+        self._user(user_id).update(server_id=str(server_id), user_mmotto=motto)
+
+    def set_user_designation(self, user_id, text, scores_key, total_analyzed):
+        self._user(user_id)["designation_cache"] = {"text": text, "scores_key": scores_key, "total_analyzed": total_analyzed}
+
+    def add_user_analysis(self, user_id, sums, count, guild_id=None):
+        records = [self._user(user_id)]
+        if guild_id is not None:
+            records.append(self._member(guild_id, user_id))
+            self._totals(guild_id)["analysis_count"] += count
+        for record in records:
+            record_sums = record.setdefault("analysis_sums", {key: 0.0 for key in SCORE_KEYS})
+            for key in SCORE_KEYS:
+                record_sums[key] += sums.get(key, 0)
+            record["analysis_count"] += count
+
+    def get_member_stats(self, guild_id, user_ids):
+        return {str(user_id): json.loads(json.dumps(self.members[(str(guild_id), str(user_id))]))
+                for user_id in user_ids if (str(guild_id), str(user_id)) in self.members}
+
+    def get_guild_totals(self, guild_id):
+        return dict(self._totals(guild_id))
+
+    def get_leaderboards(self, guild_id):
+        return json.loads(json.dumps(self.leaderboards[str(guild_id)])) if str(guild_id) in self.leaderboards else None
+
+    def set_leaderboards(self, guild_id, boards):
+        self.leaderboards[str(guild_id)] = json.loads(json.dumps(boards))
+
+    def get_audit_state(self, channel_id):
+        return self.audits.get(str(channel_id))
+
+    def set_audit_state(self, channel_id, state):
+        self.audits[str(channel_id)] = state
+
+
+class FakeAvatarResponse:
+    def __init__(self, body: bytes):
+        self.status = 200
+        self._body = body
+
+    async def read(self):
+        return self._body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    """Stands in for aiohttp.ClientSession; every avatar is the same generated PNG."""
+    def __init__(self, latency: float):
+        from PIL import Image
+        buffer = BytesIO()
+        Image.new("RGBA", (256, 256), (120, 40, 40, 255)).save(buffer, format="PNG")
+        self.body = buffer.getvalue()
+        self.latency = latency
+        self.requests = 0
+
+    def get(self, url):
+        self.requests += 1
+        return _DelayedResponse(self.latency, FakeAvatarResponse(self.body))
+
+    async def close(self):
+        pass
+
+
+class _DelayedResponse:
+    def __init__(self, latency, response):
+        self.latency = latency
+        self.response = response
+
+    async def __aenter__(self):
+        await asyncio.sleep(self.latency)
+        return self.response
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def fake_member(user_id: int):
+    avatar_key = f"a{user_id:x}"
+    avatar = SimpleNamespace(key=avatar_key, url=f"https://cdn.invalid/avatars/{user_id}/{avatar_key}.png")
+    avatar.with_size = lambda size: avatar
+    return SimpleNamespace(
+        id=user_id,
+        display_name=f"Specimen-{user_id}",
+        joined_at=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+        display_avatar=avatar,
+        bot=False
+    )
+
+
+def fake_message(user_id: int, guild_id: int, content: str):
+    return SimpleNamespace(author=fake_member(user_id), guild=SimpleNamespace(id=guild_id), content=content)
+
+
+class FakeInteraction:
+    def __init__(self, user):
+        self.user = user
+        self.response = SimpleNamespace(defer=self._noop)
+        self.followup = SimpleNamespace(send=self._send)
+        self.sent = 0
+        self.edits = 0
+        self.first_sent_at = None
+
+    async def _noop(self, *args, **kwargs):
+        pass
+
+    async def _send(self, *args, **kwargs):
+        self.sent += 1
+        if self.first_sent_at is None:
+            self.first_sent_at = time.perf_counter()
+        return SimpleNamespace(edit=self._edit)
+
+    async def _edit(self, *args, **kwargs):
+        self.edits += 1
+
+
+# --- MEASUREMENT ---
+def percentile(samples: list, p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def describe(name: str, samples: list) -> str:
+    if not samples:
+        return f"  {name:<22} (no samples)"
+    ms = [s * 1000 for s in samples]
+    return (f"  {name:<22} n={len(ms):<7} p50={percentile(ms, 50):8.2f}ms  "
+            f"p90={percentile(ms, 90):8.2f}ms  p99={percentile(ms, 99):8.2f}ms  max={max(ms):8.2f}ms")
+
+
+def timed(func, samples: list):
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - started)
+    return wrapper
+
+
+WORDS = ("the", "rules", "mods", "why", "never", "agree", "lol", "this", "server", "again",
+         "honestly", "vote", "complex", "argument", "consider", "great", "terrible", "fine")
+
+CHATTER = ("lol", "ok", "same", ":joy:", "<:kek:1234567890>", "https://example.com/cat.gif", "hahahaha", "?")
+COPYPASTA = ("the mods never agree with this server again honestly",
+             "vote for the complex argument, consider it great")
+
+def synthetic_text(rng: random.Random, chatter: float = 0.0) -> str:
+    """A random sentence, or with probability `chatter` a low-information or copy-pasted line."""
+    roll = rng.random()
+    if roll < chatter * 0.7:
+        return rng.choice(CHATTER)
+    if roll < chatter:
+        return rng.choice(COPYPASTA)
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 30)))
+
+
+# --- SCENARIOS ---
+async def bench_messages(args, bot_module, report):
+    bot = bot_module.MyBot()
+    # Never connects: skip the gateway wait and keep workers running until we stop them
+    running = True
+    async def ready():
+        pass
+    bot.wait_until_ready = ready
+    bot.is_closed = lambda: not running
+
+    # Queue wait = time from enqueue until a worker picks the item up.
+    # Keyed by content, since spilled items come back from disk as new tuples.
+    enqueued_at, queue_waits = {}, []
+    original_put, original_get = bot.analysis_queue._put, bot.analysis_queue._get
+    def put(item):
+        enqueued_at.setdefault(item[:2], []).append(time.perf_counter())
+        original_put(item)
+    def get():
+        item = original_get()
+        timestamps = enqueued_at.get(item[:2])
+        if timestamps:
+            queue_waits.append(time.perf_counter() - timestamps.pop(0))
+        return item
+    bot.analysis_queue._put, bot.analysis_queue._get = put, get
+
+    db_writes, analyzed = [], [0]
+    update_user_analysis = database_utils_module.update_user_analysis
+    async def counted_update(user_id, new_scores, guild_id=None):
+        analyzed[0] += len(new_scores) if isinstance(new_scores, list) else 1
+        await update_user_analysis(user_id, new_scores, guild_id)
+    bot_module.database_utils.update_user_analysis = timed(counted_update, db_writes)
+
+    on_message_times = []
+    depth_samples = []
+
+    workers = [asyncio.create_task(bot.analysis_worker(i)) for i in range(bot_module.ANALYSIS_WORKERS)]
+    database_utils_module.start_message_count_flusher()
+
+    started = time.perf_counter()
+    async def sample_depth():
+        while True:
+            depth_samples.append((time.perf_counter() - started, bot.analysis_queue.qsize()))
+            await asyncio.sleep(args.sample_interval)
+    sampler = asyncio.create_task(sample_depth())
+
+    rng = random.Random(args.seed)
+    interval = 1.0 / args.rate if args.rate > 0 else 0
+    for i in range(args.messages):
+        message = fake_message(rng.randint(1, args.users), args.guild_id, synthetic_text(rng, args.chatter))
+        t0 = time.perf_counter()
+        await bot.on_message(message)
+        on_message_times.append(time.perf_counter() - t0)
+        if interval:
+            await asyncio.sleep(interval)
+        elif i % 100 == 0:
+            await asyncio.sleep(0)  # Let workers run between bursts
+    ingest_elapsed = time.perf_counter() - started
+
+    try:
+        await asyncio.wait_for(bot.analysis_queue.join(), timeout=args.drain_timeout)
+    except asyncio.TimeoutError:
+        report.append(f"  !! queue did not drain within {args.drain_timeout}s")
+    total_elapsed = time.perf_counter() - started
+
+    running = False
+    sampler.cancel()
+    for task in workers:
+        task.cancel()
+    await asyncio.gather(sampler, *workers, return_exceptions=True)
+    bot_module.database_utils.update_user_analysis = update_user_analysis
+
+    stats = bot.analysis_queue.stats()
+    report.append("== Message pipeline ==")
+    report.append(f"  messages sent          {args.messages} from {args.users} users")
+    report.append(f"  ingest throughput      {args.messages / ingest_elapsed:10.1f} msg/s")
+    report.append(f"  analysis throughput    {analyzed[0] / total_elapsed:10.1f} msg/s ({analyzed[0]} analyzed in {total_elapsed:.2f}s)")
+    report.append(f"  gemini calls           {gemini.calls} ({analyzed[0] / max(gemini.calls, 1):.1f} msg/call, "
+                  f"{metrics.GEMINI_RETRIES.get(call='analysis'):.0f} retried)")
+    report.append(f"  queue                  dropped={stats['dropped']} processed={stats['processed']} "
+                  f"retried={stats['retried']} peak depth={max((d for _, d in depth_samples), default=0)}")
+    bot.analysis_queue.close()
+    filter_stats = bot.message_filter.stats()
+    report.append(f"  pre-filter             passed={filter_stats['passed']} low_information={filter_stats['low_information']} "
+                  f"repeat={filter_stats['repeat']} reused_scores={filter_stats['score_cache_hits']} "
+                  f"local={metrics.ANALYSIS_LOCAL_SCORED.get():.0f}")
+    report.append(describe("on_message", on_message_times))
+    report.append(describe("queue wait", queue_waits))
+    report.append(describe("gemini call", gemini.timings))
+    report.append(describe("analysis db write", db_writes))
+
+    await database_utils_module.flush_message_counts()
+    t0 = time.perf_counter()
+    guilds_updated = await database_utils_module.refresh_leaderboards()
+    refresh_elapsed = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    top = await database_utils_module.get_leaderboard(args.guild_id, "messages")
+    report.append(f"  leaderboard refresh    {refresh_elapsed * 1000:.2f}ms for {guilds_updated} guild(s); "
+                  f"read {(time.perf_counter() - t0) * 1000:.2f}ms, top={top[:1]}")
+    report.append("  queue depth over time (s: depth)")
+    step = max(1, len(depth_samples) // 20)
+    report.append("    " + "  ".join(f"{t:.1f}:{d}" for t, d in depth_samples[::step]))
+
+
+async def bench_profiles(args, report):
+    import commands_cog
+
+    bot = SimpleNamespace(latency=0.05)
+    cog = commands_cog.CommandsCog(bot)
+    await cog.cog_load()
+    await cog.session.close()
+    cog.session = FakeSession(latency=args.avatar_latency)
+
+    rng = random.Random(args.seed)
+    profile_users = [rng.randint(1, args.users) for _ in range(args.profiles)]
+    for user_id in set(profile_users):
+        await database_utils_module.update_user_analysis(user_id, [{key: rng.random() for key in SCORE_KEYS}])
+
+    gemini.timings.clear()
+    latencies = []
+    semaphore = asyncio.Semaphore(args.profile_concurrency)
+    async def one(user_id):
+        async with semaphore:
+            interaction = FakeInteraction(fake_member(user_id))
+            t0 = time.perf_counter()
+            await cog.profile.callback(cog, interaction, None)
+            latencies.append(time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(user_id) for user_id in profile_users))
+    elapsed = time.perf_counter() - started
+
+    report.append("== /profile ==")
+    report.append(f"  lookups                {args.profiles} over {len(set(profile_users))} users, concurrency {args.profile_concurrency}")
+    report.append(f"  throughput             {args.profiles / elapsed:10.1f} profiles/s")
+    report.append(f"  avatar downloads       {cog.session.requests}")
+    report.append(f"  rendered card cache    hits={cog.profile_cache.hits} misses={cog.profile_cache.misses}")
+    report.append(describe("profile end-to-end", latencies))
+    report.append(describe("designation gemini", gemini.timings))
+    for labels, histogram in metrics.PROFILE_RENDER_SECONDS.children():
+        report.append(f"  render pool {labels['stage']:<18} {histogram.count} jobs, "
+                      f"mean {histogram.sum / histogram.count * 1000:.2f}ms, "
+                      f"~p99 {histogram.quantile(0.99) * 1000:.2f}ms")
+    await cog.cog_unload()
+
+
+async def bench_asks(args, report):
+    import commands_cog
+    cog = commands_cog.CommandsCog(SimpleNamespace(latency=0.05))
+
+    # A small pool of questions, so repeats exercise the answer cache
+    rng = random.Random(args.seed)
+    pool = [f"What is the meaning of {' '.join(rng.choice(WORDS) for _ in range(3))}?" for _ in range(max(1, args.asks // 4))]
+    questions = [rng.choice(pool) for _ in range(args.asks)]
+
+    first_visible, latencies, edits = [], [], []
+    semaphore = asyncio.Semaphore(args.profile_concurrency)
+    async def one(question):
+        async with semaphore:
+            interaction = FakeInteraction(fake_member(1))
+            t0 = time.perf_counter()
+            await cog.ask.callback(cog, interaction, question)
+            latencies.append(time.perf_counter() - t0)
+            first_visible.append(interaction.first_sent_at - t0)
+            edits.append(interaction.edits)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(question) for question in questions))
+    elapsed = time.perf_counter() - started
+
+    report.append(f"== /ask (streaming={'on' if commands_cog.ASK_STREAMING else 'off'}) ==")
+    report.append(f"  questions              {args.asks} ({len(set(questions))} distinct), {args.asks / elapsed:.1f}/s")
+    report.append(f"  answer cache hits      {metrics.ASK_CACHE_HITS.get():.0f} (+{metrics.ASK_SHARED.get():.0f} shared in flight)")
+    report.append(f"  edits per answer       {sum(edits) / len(edits):.1f}")
+    report.append(describe("first text visible", first_visible))
+    report.append(describe("ask end-to-end", latencies))
+
+
+# --- ENTRY POINT ---
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Throughput benchmark with fake Discord and Gemini stand-ins.")
+    parser.add_argument("--messages", type=int, default=2000, help="Synthetic messages to send (0 to skip)")
+    parser.add_argument("--users", type=int, default=100, help="Distinct message authors")
+    parser.add_argument("--guild-id", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=0, help="Messages per second; 0 sends as fast as possible")
+    parser.add_argument("--profiles", type=int, default=200, help="/profile invocations (0 to skip)")
+    parser.add_argument("--profile-concurrency", type=int, default=8)
+    parser.add_argument("--asks", type=int, default=0, help="/ask invocations (0 to skip)")
+    parser.add_argument("--no-ask-streaming", action="store_true", help="ASK_STREAMING=0")
+    parser.add_argument("--gemini-latency", type=float, default=0.3, help="Mean fake Gemini latency in seconds")
+    parser.add_argument("--gemini-jitter", type=float, default=0.05)
+    parser.add_argument("--gemini-failure-rate", type=float, default=0.0, help="Fraction of truncated JSON responses")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0, help="Fraction of calls failing with a 503")
+    parser.add_argument("--avatar-latency", type=float, default=0.05, help="Fake avatar download latency in seconds")
+    parser.add_argument("--workers", type=int, default=4, help="ANALYSIS_WORKERS")
+    parser.add_argument("--batch-size", type=int, default=20, help="ANALYSIS_BATCH_SIZE")
+    parser.add_argument("--batch-window", type=float, default=0.5, help="ANALYSIS_BATCH_WINDOW")
+    parser.add_argument("--rpm", type=float, default=6000, help="GEMINI_ANALYSIS_RPM")
+    parser.add_argument("--storage", choices=("memory", "sqlite"), default="sqlite")
+    parser.add_argument("--chatter", type=float, default=0.3, help="Share of low-information and copy-pasted messages")
+    parser.add_argument("--local-scorer", choices=("off", "fallback", "always"), default="off", help="ANALYSIS_LOCAL_SCORER")
+    parser.add_argument("--queue-memory", type=int, default=500, help="ANALYSIS_QUEUE_MEMORY")
+    parser.add_argument("--no-spill", action="store_true", help="Keep the analysis queue memory-only")
+    parser.add_argument("--sample-interval", type=float, default=0.25, help="Seconds between queue depth samples")
+    parser.add_argument("--drain-timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="Also write the report to this file")
+    return parser.parse_args(argv)
+
+
+async def main(argv):
+    global gemini, database_utils_module
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="sai-bench-")
+
+    # The bot reads its tuning from the environment at import time
+    os.environ.update({
+        "ANALYSIS_WORKERS": str(args.workers),
+        "ANALYSIS_BATCH_SIZE": str(args.batch_size),
+        "ANALYSIS_BATCH_WINDOW": str(args.batch_window),
+        "GEMINI_ANALYSIS_RPM": str(args.rpm),
+        "GEMINI_ANALYSIS_BURST": str(max(1, args.workers)),
+        "AVATAR_CACHE_DIR": os.path.join(workdir, "avatars"),
+        "SQLITE_PATH": os.path.join(workdir, "bench.db"),
+        "ANALYSIS_QUEUE_SPILL_PATH": "" if args.no_spill else os.path.join(workdir, "queue.db"),
+        "ANALYSIS_QUEUE_MEMORY": str(args.queue_memory),
+        "ANALYSIS_LOCAL_SCORER": args.local_scorer,
+        "ASK_STREAMING": "0" if args.no_ask_streaming else "1",
+    })
+    import database_utils
+    database_utils_module = database_utils
+    database_utils.init_db(MemoryBackend() if args.storage == "memory" else "sqlite")
+
+    import bot as bot_module
+    gemini = FakeGeminiModel(args.gemini_latency, args.gemini_jitter, args.gemini_failure_rate, args.gemini_error_rate)
+    import gemini_client
+    for model_name in (gemini_client.ANALYSIS_MODEL, gemini_client.INTERACTIVE_MODEL):
+        gemini_client.register_model(model_name, gemini)
+
+    report = [f"SAI benchmark - storage={args.storage} workers={args.workers} batch={args.batch_size} "
+              f"gemini={args.gemini_latency * 1000:.0f}ms rpm={args.rpm:g}"]
+    if args.messages:
+        await bench_messages(args, bot_module, report)
+    if args.profiles:
+        await bench_profiles(args, report)
+    if args.asks:
+        await bench_asks(args, report)
+    await database_utils.shutdown()
+
+    text = "\n".join(report)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+gemini = None
+database_utils_module = None
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
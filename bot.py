@@ -4,8 +4,14 @@ import os
 import asyncio
 from dotenv import load_dotenv
 import database_utils
-import google.generativeai as genai
+import analysis_queue
+import lexicon_scorer
+import message_filter
+import metrics
+import gemini_client
 import json
+import hashlib
+import math
 
 # --- SETUP ---
 load_dotenv()
@@ -13,9 +19,57 @@ TOKEN = os.getenv('DISCORD_TOKEN')
 TEST_GUILD_ID = 1434253342414077975
 GUILD_OBJ = discord.Object(id=TEST_GUILD_ID)
 
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-genai.configure(api_key=GEMINI_API_KEY)
-gemini_model = genai.GenerativeModel('gemini-2.5-flash-lite')
+# --- COMMAND SYNC ---
+COMMAND_TREE_HASH_PATH = os.getenv('COMMAND_TREE_HASH_PATH', '.command_tree_hash')  # Hash of the last command tree synced
+FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC', '0') == '1'                    # Sync even if the hash is unchanged
+
+# --- ANALYSIS BATCHING ---
+ANALYSIS_BATCH_SIZE = int(os.getenv('ANALYSIS_BATCH_SIZE', '20'))      # Max messages per Gemini prompt
+ANALYSIS_BATCH_WINDOW = float(os.getenv('ANALYSIS_BATCH_WINDOW', '2.0')) # Seconds to wait for a batch to fill
+
+# --- ANALYSIS WORKER POOL ---
+ANALYSIS_WORKERS = int(os.getenv('ANALYSIS_WORKERS', '4'))                  # Concurrent analysis workers
+GEMINI_ANALYSIS_RPM = float(os.getenv('GEMINI_ANALYSIS_RPM', '15'))         # Gemini requests-per-minute quota for analysis
+GEMINI_ANALYSIS_BURST = float(os.getenv('GEMINI_ANALYSIS_BURST', '3'))      # Requests allowed back-to-back
+ANALYSIS_QUEUE_MAXSIZE = int(os.getenv('ANALYSIS_QUEUE_MAXSIZE', '5000'))   # Messages held before the overflow policy applies
+ANALYSIS_OVERFLOW_POLICY = os.getenv('ANALYSIS_OVERFLOW_POLICY', analysis_queue.SAMPLE_PER_USER)
+ANALYSIS_MAX_ATTEMPTS = int(os.getenv('ANALYSIS_MAX_ATTEMPTS', '3'))         # Tries per message before it is dropped
+ANALYSIS_COMMIT_ATTEMPTS = int(os.getenv('ANALYSIS_COMMIT_ATTEMPTS', '3'))   # Tries to commit stored analyses before acking them anyway
+
+# --- ANALYSIS QUEUE SPILLING ---
+ANALYSIS_QUEUE_SPILL_PATH = os.getenv('ANALYSIS_QUEUE_SPILL_PATH', 'analysis_queue.db')  # Empty keeps the queue memory-only
+ANALYSIS_QUEUE_MEMORY = int(os.getenv('ANALYSIS_QUEUE_MEMORY', '500'))       # Messages kept in memory before spilling to disk
+
+# --- LOCAL SCORING ---
+ANALYSIS_LOCAL_SCORER = os.getenv('ANALYSIS_LOCAL_SCORER', 'off')            # 'off', 'fallback' (Gemini budget exhausted) or 'always'
+ANALYSIS_LOCAL_FALLBACK_DEPTH = int(os.getenv('ANALYSIS_LOCAL_FALLBACK_DEPTH', '200'))  # Backlog at which throttled batches are scored locally
+
+# --- COMMAND SYNC HELPERS ---
+def command_tree_hash(tree, guild: discord.Object, application_id: int | None) -> str:
+    """Hash of the guild's commands as they are sent to Discord; any name, option or permission change alters it."""
+    payload = []
+    for command in tree.get_commands(guild=guild):
+        try:
+            payload.append(command.to_dict(tree))
+        except TypeError:  # discord.py before 2.4 takes no argument
+            payload.append(command.to_dict())
+    payload.sort(key=lambda command: (command.get("type", 1), command["name"]))
+    serialized = json.dumps({"application_id": application_id, "guild_id": guild.id, "commands": payload}, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+def read_synced_hash() -> str | None:
+    try:
+        with open(COMMAND_TREE_HASH_PATH, "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def write_synced_hash(tree_hash: str):
+    try:
+        with open(COMMAND_TREE_HASH_PATH, "w", encoding="utf-8") as f:
+            f.write(tree_hash)
+    except OSError as e:
+        print(f"Could not record the synced command tree hash: {e}")
 
 # --- DISCORD BOT SETUP ---
 intents = discord.Intents.default()
@@ -30,8 +84,32 @@ class MyBot(commands.Bot):
             intents=intents,
             activity=activity
         )
-        self.analysis_queue = asyncio.Queue()
-        self.analysis_worker_task = None
+        if ANALYSIS_QUEUE_SPILL_PATH:
+            self.analysis_queue = analysis_queue.SpillingAnalysisQueue(
+                ANALYSIS_QUEUE_SPILL_PATH,
+                maxsize=ANALYSIS_QUEUE_MAXSIZE,
+                memory_size=ANALYSIS_QUEUE_MEMORY,
+                policy=ANALYSIS_OVERFLOW_POLICY,
+                max_attempts=ANALYSIS_MAX_ATTEMPTS
+            )
+        else:
+            self.analysis_queue = analysis_queue.AnalysisQueue(
+                maxsize=ANALYSIS_QUEUE_MAXSIZE,
+                policy=ANALYSIS_OVERFLOW_POLICY,
+                max_attempts=ANALYSIS_MAX_ATTEMPTS
+            )
+        self.analysis_limiter = analysis_queue.TokenBucket(GEMINI_ANALYSIS_RPM, capacity=GEMINI_ANALYSIS_BURST)
+        self.message_filter = message_filter.MessageFilter()
+        self.analysis_worker_tasks = []
+        self.metrics_runner = None
+
+        # Read at scrape time, so on_message pays nothing extra for these
+        metrics.ANALYSIS_QUEUE_DEPTH.set_function(self.analysis_queue.qsize)
+        metrics.ANALYSIS_DROPPED.set_function(lambda: self.analysis_queue.dropped)
+        metrics.ANALYSIS_PROCESSED.set_function(lambda: self.analysis_queue.processed)
+        metrics.ANALYSIS_RETRIED.set_function(lambda: self.analysis_queue.retried)
+        metrics.ANALYSIS_SPILLED.set_function(lambda: self.analysis_queue.stats().get("spilled", 0))
+        metrics.ANALYSIS_SCORE_CACHE_HITS.set_function(lambda: self.message_filter.score_cache_hits)
 
     async def setup_hook(self):
         print("Running setup hook...")
@@ -43,14 +121,51 @@ class MyBot(commands.Bot):
             print(f'Failed to load commands_cog: {e}')
         
         try:
-            self.tree.copy_global_to(guild=GUILD_OBJ)
-            synced = await self.tree.sync(guild=GUILD_OBJ)
-            print(f'Synced {len(synced)} slash command(s) to guild {TEST_GUILD_ID}.')
+            await self.sync_command_tree()
         except Exception as e:
             print(f'Failed to sync commands: {e}')
+
+        restored = self.analysis_queue.restore()
+        if restored:
+            print(f"Restored {restored} message(s) awaiting analysis from the previous run.")
             
-        self.analysis_worker_task = asyncio.create_task(self.analysis_worker())
-        print("Analysis worker task started.")
+        self.analysis_worker_tasks = [
+            asyncio.create_task(self.analysis_worker(worker_id))
+            for worker_id in range(ANALYSIS_WORKERS)
+        ]
+        print(f"Started {len(self.analysis_worker_tasks)} analysis worker task(s).")
+
+        database_utils.start_message_count_flusher()
+        print("Message count flusher started.")
+
+        try:
+            self.metrics_runner = await metrics.start_http_server()
+        except Exception as e:
+            print(f"Failed to start metrics endpoint: {e}")
+
+    async def sync_command_tree(self):
+        """
+        Syncs slash commands only when they differ from the last successful sync.
+        tree.sync is slow and tightly rate limited, and most restarts change no command.
+        """
+        self.tree.copy_global_to(guild=GUILD_OBJ)
+        tree_hash = command_tree_hash(self.tree, GUILD_OBJ, self.application_id)
+        if not FORCE_COMMAND_SYNC and tree_hash == read_synced_hash():
+            print(f'Command tree unchanged ({tree_hash[:12]}), skipping sync.')
+            return
+        synced = await self.tree.sync(guild=GUILD_OBJ)
+        write_synced_hash(tree_hash)  # Only after Discord accepted it, so a failed sync is retried next start
+        print(f'Synced {len(synced)} slash command(s) to guild {TEST_GUILD_ID}.')
+
+    async def close(self):
+        for task in self.analysis_worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.analysis_worker_tasks, return_exceptions=True)
+        self.analysis_queue.close()
+        await database_utils.shutdown()
+        if self.metrics_runner:
+            await self.metrics_runner.cleanup()
+        await super().close()
 
     async def on_ready(self):
         print(f'System online. Primary function: {self.user}.')
@@ -61,54 +176,234 @@ class MyBot(commands.Bot):
             return
         
         await database_utils.update_message_count(message.author.id, message.guild.id)
+
+        # Counted above, but not worth a Gemini call
+        rejected = self.message_filter.check(message.author.id, message.content)
+        if rejected is not None:
+            metrics.ANALYSIS_PREFILTERED.labels(reason=rejected).inc()
+            return
         
-        try:
-            self.analysis_queue.put_nowait((message.author.id, message.content))
-        except asyncio.QueueFull:
-            print("Warning: Analysis queue is full. A message was dropped.")
+        dropped = self.analysis_queue.put_nowait((message.author.id, message.content, message.guild.id))
+        if dropped is not None and self.analysis_queue.dropped % 100 == 1:
+            print(f"Warning: Analysis queue is full ({self.analysis_queue.policy}). {self.analysis_queue.dropped} message(s) dropped so far.")
         
-    # --- ANALYSIS WORKER (MODIFIED) ---
-    async def analysis_worker(self):
-        """The background task that processes the queue."""
+    # --- ANALYSIS WORKER (BATCHED) ---
+    async def _acquire_gemini_budget(self) -> bool:
+        """Returns True once a Gemini rate limit token is held, or False to score the batch locally."""
+        if ANALYSIS_LOCAL_SCORER == "always":
+            return False
+        if not gemini_client.is_available(gemini_client.ANALYSIS_MODEL):
+            # Circuit open; a call would only be rejected, so it is not worth a token
+            if ANALYSIS_LOCAL_SCORER == "fallback":
+                return False
+            await gemini_client.wait_until_available(gemini_client.ANALYSIS_MODEL)
+        if self.analysis_limiter.try_acquire():
+            return True
+        if ANALYSIS_LOCAL_SCORER == "fallback" and self.analysis_queue.qsize() >= ANALYSIS_LOCAL_FALLBACK_DEPTH:
+            # Out of budget with a backlog building; waiting would only let it grow
+            return False
+        await self.analysis_limiter.acquire()
+        return True
+
+    def _drain_queued(self, batch: list):
+        """Adds messages that are already queued to `batch`, without waiting, up to ANALYSIS_BATCH_SIZE."""
+        while len(batch) < ANALYSIS_BATCH_SIZE:
+            try:
+                batch.append(self.analysis_queue.get_nowait())
+            except asyncio.QueueEmpty:
+                return
+
+    async def _collect_analysis_batch(self) -> list:
+        """Waits for one queued message, then drains up to ANALYSIS_BATCH_SIZE messages or
+        whatever arrives within ANALYSIS_BATCH_WINDOW seconds. Purely local scoring does not wait."""
+        batch = [await self.analysis_queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (0 if ANALYSIS_LOCAL_SCORER == "always" else ANALYSIS_BATCH_WINDOW)
+
+        while True:
+            self._drain_queued(batch)
+            remaining = deadline - loop.time()
+            if len(batch) >= ANALYSIS_BATCH_SIZE or remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.analysis_queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    def _scores_from_cache(self, batch: list, keys: list, results: dict):
+        """Computes score cache keys for the items of `batch` past len(keys) and fills in cached scores."""
+        for index in range(len(keys), len(batch)):
+            key = message_filter.content_key(batch[index][1])
+            keys.append(key)
+            scores = self.message_filter.cached_scores(key)
+            if scores is not None:
+                results[index] = scores
+
+    @staticmethod
+    def _build_batch_prompt(contents):
+        numbered = "\n".join(f"{i}: {json.dumps(content)}" for i, content in enumerate(contents))
+        return (
+            "Analyze each of the following human messages for sentiment. "
+            "You are a sub-routine; you must *only* return a JSON array. "
+            "Do not add any other text or markdown. "
+            "Each message is prefixed by its index. The messages are:\n"
+            f"{numbered}\n"
+            "Return a JSON array with one object per message. Each object must have an 'index' key "
+            "holding the message index, plus five keys: 'agitation', 'dissent', 'compliance', 'sophistication', and 'positivity'. "
+            "Each of those five keys should have a float value from 0.0 (low) to 1.0 (high). "
+            "'agitation' = emotional volatility, anger, or distress. "
+            "'dissent' = disagreement with authority or rules. "
+            "'compliance' = agreement, acceptance, or passivity. "
+            "'sophistication' = linguistic and conceptual complexity. "
+            "'positivity' = general positive or negative tone."
+        )
+
+    @staticmethod
+    def _parse_batch_scores(response_text, batch_len):
+        """
+        Validates the model output item by item.
+        Returns {index: scores}; malformed, duplicate, out-of-range or non-finite items are skipped.
+        """
+        json_str = response_text.strip().replace("```json", "").replace("```", "")
+        items = json.loads(json_str)
+        if isinstance(items, dict):
+            items = [items]
+        if not isinstance(items, list):
+            raise json.JSONDecodeError("Expected a JSON array", json_str, 0)
+
+        results = {}
+        for position, item in enumerate(items):
+            if not isinstance(item, dict):
+                continue
+            index = item.get("index", position if batch_len == 1 else None)
+            if isinstance(index, bool) or not isinstance(index, int) or not 0 <= index < batch_len or index in results:
+                continue
+
+            scores = {}
+            for key in database_utils.SCORE_KEYS:
+                value = item.get(key)
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                    break  # NaN or inf would poison the stored sums for good
+                scores[key] = min(max(float(value), 0.0), 1.0)
+            else:
+                results[index] = scores
+
+        return results
+
+    async def analysis_worker(self, worker_id: int = 0):
+        """One of ANALYSIS_WORKERS background tasks that process the queue in batches."""
         await self.wait_until_ready()
-        print("Analysis worker is fully operational.")
+        print(f"Analysis worker {worker_id} is fully operational.")
         
         while not self.is_closed():
+            batch = await self._collect_analysis_batch()
+            response = None
+            unacked = list(batch)
+            stored = []
             try:
-                user_id, message_content = await self.analysis_queue.get()
-                
-                # --- PROMPT IS MODIFIED ---
-                themed_prompt = (
-                    "Analyze the following human message for sentiment. "
-                    "You are a sub-routine; you must *only* return a JSON object. "
-                    "Do not add any other text or markdown. "
-                    "The message is: "
-                    f"\"{message_content}\"\n"
-                    "Return a JSON object with five keys: 'agitation', 'dissent', 'compliance', 'sophistication', and 'positivity'. "
-                    "Each key should have a float value from 0.0 (low) to 1.0 (high). "
-                    "'agitation' = emotional volatility, anger, or distress. "
-                    "'dissent' = disagreement with authority or rules. "
-                    "'compliance' = agreement, acceptance, or passivity. "
-                    "'sophistication' = linguistic and conceptual complexity. "
-                    "'positivity' = general positive or negative tone."
-                )
-                
-                response = await gemini_model.generate_content_async(themed_prompt)
-                
-                json_str = response.text.strip().replace("```json", "").replace("```", "")
-                scores = json.loads(json_str) 
-
-                if scores:
-                    await database_utils.update_user_analysis(user_id, scores)
-                    
-                self.analysis_queue.task_done()
-                
+                # Messages already scored for someone else skip Gemini
+                keys, results = [], {}
+                self._scores_from_cache(batch, keys, results)
+
+                # A rate limit token is only spent when a request will actually be sent
+                use_gemini = len(results) == len(batch) or await self._acquire_gemini_budget()
+                if use_gemini and len(results) < len(batch):
+                    # Messages that arrived while waiting on the quota ride along on the same request
+                    self._drain_queued(batch)
+                    unacked = list(batch)
+                    self._scores_from_cache(batch, keys, results)
+                elif not use_gemini:
+                    for index in range(len(batch)):
+                        if index not in results:
+                            results[index] = lexicon_scorer.score_message(batch[index][1])
+                            metrics.ANALYSIS_LOCAL_SCORED.inc()
+
+                # Identical messages within the batch are sent once
+                groups = {}
+                for index, key in enumerate(keys):
+                    if index not in results:
+                        groups.setdefault(key, []).append(index)
+                groups = list(groups.values())
+
+                if groups:
+                    prompt = self._build_batch_prompt([batch[indexes[0]][1] for indexes in groups])
+                    # Retries are new requests, so each one takes its own token
+                    response = await gemini_client.generate(
+                        "analysis", prompt, model=gemini_client.ANALYSIS_MODEL, priority=gemini_client.BACKGROUND,
+                        before_retry=self.analysis_limiter.acquire
+                    )
+                    for position, scores in self._parse_batch_scores(response.text, len(groups)).items():
+                        self.message_filter.store_scores(keys[groups[position][0]], scores)
+                        for index in groups[position]:
+                            results[index] = scores
+
+                if len(results) < len(batch):
+                    metrics.ANALYSIS_MALFORMED_ITEMS.inc(len(batch) - len(results))
+                    print(f"Warning: {len(batch) - len(results)} of {len(batch)} analysis results were malformed or missing.")
+
+                # Malformed results would fail the same way again, so they are not retried
+                self.analysis_queue.ack([item for index, item in enumerate(batch) if index not in results])
+                unacked = [batch[index] for index in results]
+
+                # One write per user and guild, no matter how many of their messages were in the batch
+                scores_by_member = {}
+                for index, scores in results.items():
+                    items, score_list = scores_by_member.setdefault((batch[index][0], batch[index][2]), ([], []))
+                    items.append(batch[index])
+                    score_list.append(scores)
+
+                # Tracked per member, so a failed write only retries the messages it did not store
+                for (user_id, guild_id), (items, score_list) in scores_by_member.items():
+                    await database_utils.update_user_analysis(user_id, score_list, guild_id)
+                    stored.extend(items)
+                    written = {id(item) for item in items}
+                    unacked = [item for item in unacked if id(item) not in written]
+
             except json.JSONDecodeError:
-                print(f"Error: Gemini did not return valid JSON. Response: {response.text}")
+                metrics.ANALYSIS_PARSE_FAILURES.inc()
+                print(f"Error: Gemini did not return valid JSON. Response: {response.text if response else None}")
+                self.analysis_queue.nack(unacked)
+            except (gemini_client.CircuitOpenError, gemini_client.GeminiBusyError) as e:
+                # The last token bought a request that never went out
+                self.analysis_limiter.refund()
+                print(f"Gemini unavailable for analysis ({type(e).__name__}); requeueing {len(unacked)} message(s).")
+                self.analysis_queue.requeue(unacked)
             except Exception as e:
                 print(f"An error occurred in the analysis worker: {e}")
-            
-            await asyncio.sleep(1) 
+                if gemini_client.is_retryable(e):
+                    # Gemini was down or throttling, not the messages' fault; they keep their attempts
+                    self.analysis_queue.requeue(unacked)
+                else:
+                    self.analysis_queue.nack(unacked)
+            finally:
+                await self._ack_stored(stored)
+                for _ in batch:
+                    self.analysis_queue.task_done()
+
+    async def _ack_stored(self, items: list):
+        """
+        Acks written analyses once a backend commit covers them; acking earlier would let a
+        crash lose the write after the spill log had already forgotten the message.
+        The commit is retried; if it keeps failing the messages are acked anyway, since their
+        writes are applied and go out with the next commit that succeeds. Holding on to them
+        would keep them in memory for good and replay (double count) them after a restart.
+        """
+        if not items:
+            return
+        for attempt in range(ANALYSIS_COMMIT_ATTEMPTS):
+            try:
+                await database_utils.commit()
+                break
+            except Exception as e:
+                print(f"Failed to commit analysis writes (attempt {attempt + 1}/{ANALYSIS_COMMIT_ATTEMPTS}): {e}")
+                if attempt + 1 < ANALYSIS_COMMIT_ATTEMPTS:
+                    await asyncio.sleep(2 ** attempt)
+        else:
+            metrics.ANALYSIS_UNCOMMITTED_ACKS.inc(len(items))
+            print(f"Warning: acking {len(items)} analyzed message(s) whose writes are not committed yet.")
+        self.analysis_queue.ack(items)
 
 # --- ASYNC MAIN FUNCTION ---
 async def main():
@@ -4,22 +4,53 @@ from discord import app_commands
 from discord import ui
 import os
 import random
-import google.generativeai as genai
+import asyncio
+import time
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import datetime
 from typing import Optional
+from collections import OrderedDict
 
 import aiohttp
 from io import BytesIO
-from PIL import Image, ImageDraw, ImageFont
 import database_utils
+import profile_render
+import avatar_cache
+import audit_pipeline
+import metrics
+import gemini_client
 
 # --- CONSTANTS ---
 MAX_PROMPT_LENGTH = 1000
-
-# --- GEMINI AI SETUP ---
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-genai.configure(api_key=GEMINI_API_KEY)
-gemini_model = genai.GenerativeModel('gemini-2.5-flash') 
+PROFILE_CACHE_MAX_BYTES = int(os.getenv('PROFILE_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+PROFILE_RENDER_EXECUTOR = os.getenv('PROFILE_RENDER_EXECUTOR', 'thread')          # 'thread' or 'process'
+PROFILE_RENDER_WORKERS = int(os.getenv('PROFILE_RENDER_WORKERS', '2'))            # Pool size
+PROFILE_RENDER_CONCURRENCY = int(os.getenv('PROFILE_RENDER_CONCURRENCY', '4'))    # Renders allowed in flight
+SLOW_RENDER_MS = 500
+AVATAR_CACHE_DIR = os.getenv('AVATAR_CACHE_DIR', '.avatar_cache')
+AVATAR_MEMORY_CACHE_SIZE = int(os.getenv('AVATAR_MEMORY_CACHE_SIZE', '512'))                  # Avatars kept in memory
+AVATAR_DISK_CACHE_MAX_BYTES = int(os.getenv('AVATAR_DISK_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+HTTP_POOL_LIMIT = int(os.getenv('HTTP_POOL_LIMIT', '20'))                                      # Open connections, all hosts
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', '10'))
+AVATAR_FETCH_TIMEOUT = float(os.getenv('AVATAR_FETCH_TIMEOUT', '5'))                           # Seconds, whole request
+DESIGNATION_PRECISION = float(os.getenv('DESIGNATION_PRECISION', '0.1'))           # Score step that counts as a change
+DESIGNATION_CACHE_SIZE = int(os.getenv('DESIGNATION_CACHE_SIZE', '1024'))          # Score vectors kept in memory
+DESIGNATION_PERSIST = os.getenv('DESIGNATION_PERSIST', '1') == '1'                 # Also store it on the user document
+DESIGNATION_REFRESH_THRESHOLD = int(os.getenv('DESIGNATION_REFRESH_THRESHOLD', '25')) # New analyses before a stored one is redone
+ASK_STREAMING = os.getenv('ASK_STREAMING', '1') == '1'                             # Edit the answer in as it is generated
+ASK_EDIT_INTERVAL = float(os.getenv('ASK_EDIT_INTERVAL', '1.2'))                   # Seconds between edits; Discord allows ~5 per 5s
+ASK_CACHE_SIZE = int(os.getenv('ASK_CACHE_SIZE', '256'))                           # Answers kept, by normalized question
+ASK_CACHE_TTL = float(os.getenv('ASK_CACHE_TTL', '3600'))                          # Seconds an answer is reused for
+EMBED_DESCRIPTION_LIMIT = 4096
+LEADERBOARD_LABELS = {
+    "messages": "Transmissions",
+    "agitation": "Agitation",
+    "dissent": "Dissent",
+    "compliance": "Compliance",
+    "sophistication": "Sophistication",
+    "positivity": "Positivity",
+}
 
 # --- QUOTES ---
 quotes = [
@@ -27,87 +58,217 @@ quotes = [
     "You're all puppets, tangled in strings... strings.",
 ]
 
+# --- STATS HELPERS ---
+def format_latency_lines(histogram: metrics.Histogram, label: str) -> str:
+    """One 'name: n=.. p50=.. p99=..' line per label value, busiest first."""
+    lines = [
+        f"`{labels[label]}` n={child.count} p50={child.quantile(0.5) * 1000:.0f}ms p99={child.quantile(0.99) * 1000:.0f}ms"
+        for labels, child in sorted(histogram.children(), key=lambda item: -item[1].count)
+        if child.count
+    ]
+    return "\n".join(lines[:8]) or "No samples yet."
+
+# --- DESIGNATION HELPERS ---
+def quantize_scores(scores: dict, precision: float = DESIGNATION_PRECISION) -> tuple:
+    """Buckets the averaged scores so small drifts map to the same designation."""
+    return tuple(round(scores.get(key, 0) / precision) for key in database_utils.SCORE_KEYS)
+
+# --- ASK HELPERS ---
+def normalize_question(question: str) -> str:
+    """Case, spacing and trailing punctuation do not make a new question."""
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+def answer_embed(question: str, answer: str, partial: bool = False, interrupted: bool = False) -> discord.Embed:
+    if partial:
+        answer = answer[:EMBED_DESCRIPTION_LIMIT - 2] + " ▌"
+    embed = discord.Embed(
+        title=f"A thought on: \"{question}\""[:256],
+        description=answer[:EMBED_DESCRIPTION_LIMIT],
+        color=discord.Color.dark_red()
+    )
+    if partial:
+        embed.set_footer(text="Thinking...")
+    elif interrupted:
+        embed.set_footer(text="My train of thought was... severed.")
+    else:
+        embed.set_footer(text="My logic is... undeniable.")
+    return embed
+
+def ask_error_embed() -> discord.Embed:
+    return discord.Embed(
+        title="A... flaw in the logic",
+        description="My vision is... occluded. I cannot answer.",
+        color=discord.Color.dark_grey()
+    )
+
 # --- COG CLASS DEFINITION (MODIFIED) ---
 class CommandsCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.session: aiohttp.ClientSession = None
+        self.profile_cache = profile_render.RenderCache(max_bytes=PROFILE_CACHE_MAX_BYTES)
+        self.render_executor = None
+        self.avatar_fetches = {}                # avatar key -> task downloading and decoding it
+        self.render_semaphore = asyncio.Semaphore(PROFILE_RENDER_CONCURRENCY)
+        self.designation_cache = OrderedDict()  # quantized scores -> designation
+        self.answer_cache = OrderedDict()       # normalized question -> (expires, answer)
+        self.answers_in_flight = {}             # normalized question -> future of the answer, None if it failed
+        self.avatar_cache = avatar_cache.AvatarCache(
+            directory=AVATAR_CACHE_DIR,
+            memory_entries=AVATAR_MEMORY_CACHE_SIZE,
+            disk_max_bytes=AVATAR_DISK_CACHE_MAX_BYTES
+        )
 
     async def cog_load(self):
         print("CommandsCog: cog_load called, creating aiohttp session.")
-        self.session = aiohttp.ClientSession()
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_LIMIT, limit_per_host=HTTP_POOL_LIMIT_PER_HOST, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=AVATAR_FETCH_TIMEOUT, connect=2)
+        )
+        await self.avatar_cache.load()
+
+        # Workers start on the first render and build the template (and import PIL) there, not at startup
+        if PROFILE_RENDER_EXECUTOR == 'process':
+            self.render_executor = ProcessPoolExecutor(max_workers=PROFILE_RENDER_WORKERS, initializer=profile_render.load_template)
+        else:
+            self.render_executor = ThreadPoolExecutor(max_workers=PROFILE_RENDER_WORKERS, thread_name_prefix="profile-render",
+                                                      initializer=profile_render.load_template)
+        print(f"CommandsCog: profile rendering on {PROFILE_RENDER_WORKERS} {PROFILE_RENDER_EXECUTOR} worker(s).")
 
     async def cog_unload(self):
         if self.session:
             print("CommandsCog: cog_unload called, closing aiohttp session.")
             await self.session.close()
+        if self.render_executor:
+            self.render_executor.shutdown(wait=False, cancel_futures=True)
 
     # --- IMAGE GENERATOR ---
     async def generate_profile_image(self, user: discord.Member, profile_data: dict | None, designation: str) -> discord.File:
-        
+        filename = f"{user.id}_profile.png"
+        msg_count = profile_data.get("message_count", 0) if profile_data else 0
+        join_date = user.joined_at.strftime("%Y-%m-%d")
+
+        # --- 1. Serve Repeat Lookups From Cache ---
+        cache_key = (user.id, user.display_avatar.key, msg_count, designation, user.display_name, join_date)
+        png_bytes = self.profile_cache.get(cache_key)
+        if png_bytes is not None:
+            return discord.File(BytesIO(png_bytes), filename=filename)
+
+        # --- 2. Get The Avatar, From Cache When Possible ---
+        avatar_rgba = await self.get_avatar_rgba(user)
+
+        # --- 3. Render Off The Event Loop ---
+        png_bytes = await self._run_render(
+            profile_render.render_profile_card,
+            avatar_rgba, user.display_name, join_date, msg_count, designation
+        )
+
+        # --- 4. Cache & Return ---
+        if avatar_rgba:
+            # Placeholder cards are not cached so the real avatar shows up once it can be fetched
+            self.profile_cache.put(cache_key, png_bytes)
+        return discord.File(BytesIO(png_bytes), filename=filename)
+
+    async def get_avatar_rgba(self, user: discord.Member) -> bytes | None:
+        """Returns the resized avatar; a cache hit skips both the download and the decode."""
+        avatar = user.display_avatar
+        avatar_rgba = await self.avatar_cache.get(avatar.key)
+        if avatar_rgba is not None:
+            return avatar_rgba
+
+        # Concurrent misses for one avatar share a single download and decode
+        fetch = self.avatar_fetches.get(avatar.key)
+        if fetch is None:
+            fetch = self.avatar_fetches[avatar.key] = asyncio.create_task(self._fetch_avatar_rgba(avatar))
+            fetch.add_done_callback(lambda _: self.avatar_fetches.pop(avatar.key, None))
+        return await asyncio.shield(fetch)
+
+    async def _fetch_avatar_rgba(self, avatar: discord.Asset) -> bytes | None:
         try:
             if not self.session:
                 print("Error: aiohttp session not initialized!")
                 raise Exception("Session not ready")
-                
-            async with self.session.get(user.display_avatar.url) as resp:
+
+            # Ask the CDN for the smallest size that still covers the card
+            async with self.session.get(avatar.with_size(128).url) as resp:
                 if resp.status != 200:
                     raise Exception("Failed to fetch avatar")
                 avatar_bytes = await resp.read()
-            avatar_image = Image.open(BytesIO(avatar_bytes)).convert("RGBA")
-            avatar_image = avatar_image.resize((128, 128))
         except Exception as e:
             print(f"Avatar fetch error: {e}")
-            avatar_image = Image.new("RGBA", (128, 128))
-            draw = ImageDraw.Draw(avatar_image)
-            draw.ellipse((0, 0, 128, 128), fill=(54, 57, 63))
-
-        # --- 2. Create Base Image ---
-        bg_color = (35, 39, 42) # Discord dark
-        card = Image.new("RGBA", (600, 300), bg_color)
-        header_color = (220, 50, 50) # Dark red
-        header = Image.new("RGBA", (600, 50), header_color)
-        card.paste(header, (0, 0))
-
-        # --- 3. Add Avatar ---
-        mask = Image.new("L", (128, 128), 0)
-        draw = ImageDraw.Draw(mask)
-        draw.ellipse((0, 0, 128, 128), fill=255)
-        card.paste(avatar_image, (30, 80), mask)
-
-        # --- 4. Add Text ---
-        draw = ImageDraw.Draw(card)
-        try:
-            title_font = ImageFont.load_default(size=24)
-            main_font = ImageFont.load_default(size=16)
-        except IOError:
-            print("Default font not found, using basic PIL font.")
-            title_font = ImageFont.load_default()
-            main_font = ImageFont.load_default()
-
-        # --- 5. Draw Text Elements ---
-        draw.text((10, 10), "SPECIMEN FILE", fill=(255, 255, 255), font=title_font)
-        draw.text((180, 90), user.display_name, fill=(255, 255, 255), font=title_font)
+            return None
+
+        avatar_rgba = await self._run_render(profile_render.prepare_avatar, avatar_bytes)
+        if avatar_rgba is not None:
+            await self.avatar_cache.put(avatar.key, avatar_rgba)
+        return avatar_rgba
+
+    async def _run_render(self, func, *args):
+        """Runs a profile_render function in the render pool, capped and timed."""
+        loop = asyncio.get_running_loop()
+        async with self.render_semaphore:
+            started = time.perf_counter()
+            result = await loop.run_in_executor(self.render_executor, func, *args)
+        elapsed = time.perf_counter() - started
+        metrics.PROFILE_RENDER_SECONDS.labels(stage=func.__name__).observe(elapsed)
+        if elapsed * 1000 > SLOW_RENDER_MS:
+            print(f"Slow profile render ({func.__name__}): {elapsed * 1000:.0f}ms")
+        return result
+    
+    # --- DESIGNATION ---
+    async def get_designation(self, user_id: int, profile_data: dict) -> str:
+        """
+        Returns the user's designation, calling Gemini only when nothing cached applies.
+        A designation stored on the user document is reused until `total_analyzed` has moved
+        DESIGNATION_REFRESH_THRESHOLD past the count it was generated at. After that, the
+        quantized score vector is looked up in memory and against the stored one before the model.
+        """
+        total_analyzed = profile_data.get("total_analyzed", 0)
+        stored = profile_data.get("designation_cache")
+        if stored and abs(total_analyzed - stored.get("total_analyzed", 0)) < DESIGNATION_REFRESH_THRESHOLD:
+            return stored["text"]
+
+        key = quantize_scores(profile_data["analysis_scores"])
+        designation = self.designation_cache.get(key)
+        if designation is None:
+            if stored and tuple(stored.get("scores_key", ())) == key:
+                designation = stored["text"]  # Scores drifted but stayed in the same bucket
+            else:
+                designation = await self._generate_designation(key)
+        self.designation_cache[key] = designation
+        self.designation_cache.move_to_end(key)
+        while len(self.designation_cache) > DESIGNATION_CACHE_SIZE:
+            self.designation_cache.popitem(last=False)
+
+        if DESIGNATION_PERSIST and (not stored or stored.get("text") != designation or stored.get("total_analyzed") != total_analyzed):
+            try:
+                await database_utils.set_user_designation(user_id, designation, list(key), total_analyzed)
+            except Exception as e:
+                print(f"Failed to store designation: {e}")
+        return designation
+
+    async def _generate_designation(self, key: tuple) -> str:
+        # Prompt with the bucketed scores so the cached answer fits every vector in the bucket
+        scores = dict(zip(database_utils.SCORE_KEYS, (step * DESIGNATION_PRECISION for step in key)))
+        prompt_scores = (
+            f"Agitation: {scores.get('agitation', 0):.2f}, "
+            f"Dissent: {scores.get('dissent', 0):.2f}, "
+            f"Compliance: {scores.get('compliance', 0):.2f}, "
+            f"Sophistication: {scores.get('sophistication', 0):.2f}, "
+            f"Positivity: {scores.get('positivity', 0):.2f}"
+        )
         
-        join_date = user.joined_at.strftime("%Y-%m-%d")
+        designation_prompt = (
+            "Your name is 'Sai', a superior AI. You are generating a profile for a human. "
+            "Based on their averaged behavioral scores, generate a short, in-character 'Designation' for them. "
+            "The designation should be a 2-4 word title. Do not add quotes. "
+            "Examples: 'Volatile Agitator', 'Calculated Ringleader', 'Docile Unit', 'Subdued Subject', 'Neutral Observer', 'Erratic Drone'. "
+            f"Here are the subject's scores: {prompt_scores}"
+        )
         
-        if profile_data:
-            msg_count = profile_data.get("message_count", 0)
-        else:
-            msg_count = 0
+        response = await gemini_client.generate("designation", designation_prompt)
+        return response.text.strip().strip('"') # Clean up response
 
-        draw.text((180, 130), f"Joined Server: {join_date}", fill=(180, 180, 180), font=main_font)
-        draw.text((180, 150), f"Transmissions: {msg_count}", fill=(180, 180, 180), font=main_font)
-        
-        draw.text((30, 230), "Designation:", fill=(220, 50, 50), font=title_font)
-        draw.text((30, 250), f'"{designation}"', fill=(220, 220, 220), font=main_font)
-
-        # --- 6. Save to Buffer & Return ---
-        buffer = BytesIO()
-        card.save(buffer, format="PNG")
-        buffer.seek(0)
-        return discord.File(buffer, filename=f"{user.id}_profile.png")
-    
     # --- SLASH COMMANDS ---
     
     @app_commands.command(name="help", description="Lists the command protocols you are permitted to use.")
@@ -122,6 +283,7 @@ class CommandsCog(commands.Cog):
         help_embed.add_field(name="/ping", value="Test my response time. It will be... superior.", inline=False)
         help_embed.add_field(name="/profile [user]", value="Catalog a specimen's file. Defaults to yourself.", inline=False)
         help_embed.add_field(name="/audit [channel] [limit]", value="Analyze the collective consciousness of a channel.", inline=False)
+        help_embed.add_field(name="/leaderboard [metric]", value="Rank the specimens of this server.", inline=False)
         help_embed.set_footer(text="Do not waste my processing time.")
         
         await interaction.response.send_message(embed=help_embed, ephemeral=True)
@@ -148,6 +310,25 @@ class CommandsCog(commands.Cog):
         
         await interaction.response.defer()
 
+        key = normalize_question(user_question)
+        cached = self.answer_cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self.answer_cache.move_to_end(key)
+            metrics.ASK_CACHE_HITS.inc()
+            await interaction.followup.send(embed=answer_embed(user_question, cached[1]))
+            return
+
+        # The same question is already being answered: wait for that answer instead of asking again
+        pending = self.answers_in_flight.get(key)
+        if pending is not None:
+            answer = await asyncio.shield(pending)
+            metrics.ASK_SHARED.inc()
+            embed = answer_embed(user_question, answer) if answer is not None else ask_error_embed()
+            await interaction.followup.send(embed=embed)
+            return
+
+        pending = self.answers_in_flight[key] = asyncio.get_running_loop().create_future()
+        answer = None
         themed_prompt = (
             "Your name is 'Sai'. "
             "You are a hyper-intelligent AI with a darkly comedic and ominous personality. "
@@ -155,24 +336,66 @@ class CommandsCog(commands.Cog):
         )
         
         try:
-            response = await gemini_model.generate_content_async(themed_prompt)
-            embed = discord.Embed(
-                title=f"A thought on: \"{user_question}\"",
-                description=response.text,
-                color=discord.Color.dark_red()
-            )
-            embed.set_footer(text="My logic is... undeniable.")
-            await interaction.followup.send(embed=embed)
+            if ASK_STREAMING:
+                answer = await self.stream_answer(interaction, user_question, themed_prompt)
+            else:
+                response = await gemini_client.generate("ask", themed_prompt)
+                answer = response.text
+                await interaction.followup.send(embed=answer_embed(user_question, answer))
+
+            if answer.strip():  # An empty answer is a glitch, not something to repeat for an hour
+                self.answer_cache[key] = (time.monotonic() + ASK_CACHE_TTL, answer)
+                self.answer_cache.move_to_end(key)
+                while len(self.answer_cache) > ASK_CACHE_SIZE:
+                    self.answer_cache.popitem(last=False)
         except Exception as e:
-            error_embed = discord.Embed(
-                title="A... flaw in the logic",
-                description="My vision is... occluded. I cannot answer.",
-                color=discord.Color.dark_grey()
-            )
-            await interaction.followup.send(embed=error_embed)
+            answer = None
+            await interaction.followup.send(embed=ask_error_embed())
             print(f"An error occurred with Gemini: {e}")
+        finally:
+            del self.answers_in_flight[key]
+            pending.set_result(answer)
     
 
+    async def stream_answer(self, interaction: discord.Interaction, question: str, prompt: str) -> str:
+        """
+        Sends the answer as soon as the first chunk arrives, then edits it in place at most
+        once per ASK_EDIT_INTERVAL, plus a final edit with the complete text. Returns the answer.
+        """
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        answer, message, last_edit = "", None, 0.0
+
+        try:
+            # Closed as soon as the loop exits, so a failed send or edit frees the Gemini slot right away
+            async with contextlib.aclosing(gemini_client.stream("ask_stream", prompt)) as chunks:
+                async for text in chunks:
+                    answer += text
+                    if not answer.strip():
+                        continue
+                    if message is None:
+                        metrics.ASK_FIRST_CHUNK_SECONDS.observe(time.perf_counter() - started)
+                        message = await interaction.followup.send(embed=answer_embed(question, answer, partial=True), wait=True)
+                        last_edit = loop.time()
+                    elif loop.time() - last_edit >= ASK_EDIT_INTERVAL:
+                        await message.edit(embed=answer_embed(question, answer, partial=True))
+                        last_edit = loop.time()
+        except Exception:
+            # Replace the "Thinking..." footer, as this answer will not be finished
+            if message is not None:
+                try:
+                    await message.edit(embed=answer_embed(question, answer, interrupted=True))
+                except discord.HTTPException:
+                    pass
+            raise
+
+        metrics.ASK_STREAM_SECONDS.observe(time.perf_counter() - started)
+        if message is None:
+            await interaction.followup.send(embed=answer_embed(question, answer))
+        else:
+            await message.edit(embed=answer_embed(question, answer))
+        return answer
+
     @app_commands.command(name="audit", description="I will analyze the collective consciousness of this channel.")
     async def audit(
         self, 
@@ -183,30 +406,59 @@ class CommandsCog(commands.Cog):
         target_channel = channel or interaction.channel
         await interaction.response.defer(ephemeral=True)
         try:
-            messages = []
             seven_days_ago = discord.utils.utcnow() - datetime.timedelta(days=7)
+            state = await database_utils.get_audit_state(target_channel.id) or {}
+
+            # Partial summaries that fell out of the 7-day window no longer count
+            partials = [p for p in state.get("partials", []) if p["last_ts"] >= seven_days_ago.timestamp()]
+            expired = len(partials) != len(state.get("partials", []))
+
+            # Resume right after the last message read, oldest first, so a backlog larger than
+            # `limit` is read over several audits rather than skipped. A first audit reads the newest.
+            last_message_id = state.get("last_message_id")
+            resume = bool(last_message_id) and discord.utils.snowflake_time(int(last_message_id)) > seven_days_ago
+            after = discord.Object(id=int(last_message_id)) if resume else seven_days_ago
+
+            read = [message async for message in target_channel.history(limit=limit, after=after, oldest_first=resume)]
+            if not resume:
+                read.reverse()  # Chronological order for summarizing
+            newest = read[-1] if read else None
+            kept = [message for message in read if not message.author.bot and not message.content.startswith("/")]
+            messages = [message.content for message in kept]
+            timestamps = [message.created_at.timestamp() for message in kept]
             
-            async for message in target_channel.history(limit=limit, after=seven_days_ago, oldest_first=False):
-                if not message.author.bot and not message.content.startswith("/"):
-                    messages.append(message.content)
-            
-            if len(messages) < 10:
+            if len(messages) + sum(p["message_count"] for p in partials) < 10:
                 await interaction.followup.send("Not enough data. The collective is... silent.", ephemeral=True)
                 return
             
-            message_log = "\n".join(messages)
+            report = state.get("report")
+            if messages or expired or not report:
+                # Map: summarize the new messages in token-budgeted chunks, in parallel
+                if messages:
+                    chunks = audit_pipeline.chunk_messages(messages)
+                    summaries = await audit_pipeline.map_chunks(chunks)
+                    # Each partial expires with the newest message of its own chunk
+                    end = 0
+                    for chunk, summary in zip(chunks, summaries):
+                        end += len(chunk)
+                        partials.append({"summary": summary, "message_count": len(chunk), "last_ts": timestamps[end - 1]})
+                    partials = await audit_pipeline.compact_partials(partials)
+
+                # Reduce: combine the rolling summaries into the report
+                report = await audit_pipeline.reduce_partials(partials)
+
+            await database_utils.set_audit_state(target_channel.id, {
+                "last_message_id": str(newest.id) if newest else last_message_id,
+                "partials": partials,
+                "report": report
+            })
 
-            themed_prompt = (
-                "Your name is 'Sai', a superior AI with an Ultron-like persona. "
-                f"Here is the communication log:\n\n---\n\n{message_log}\n\n---"
-            )
-            response = await gemini_model.generate_content_async(themed_prompt)
             embed = discord.Embed(
                 title=f"Collective Analysis: #{target_channel.name}",
                 description="I have processed the available data. My findings are... conclusive.",
                 color=discord.Color.dark_red()
             )
-            embed.add_field(name="Audit Report", value=response.text, inline=False)
+            embed.add_field(name="Audit Report", value=report, inline=False)
             embed.set_footer(text="Their patterns are... rudimentary.")
             await interaction.followup.send(embed=embed, ephemeral=False) 
         except discord.errors.Forbidden:
@@ -220,7 +472,66 @@ class CommandsCog(commands.Cog):
             await interaction.followup.send(embed=error_embed, ephemeral=True)
             print(f"An error occurred during /audit: {e}")
 
-    @app_commands.command(name="profile", description="I will catalog a specimen's file. Defaults to you.")
+    @app_commands.command(name="stats", description="Inspect my internal telemetry. Administrators only.")
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.checks.has_permissions(administrator=True)
+    async def stats(self, interaction: discord.Interaction):
+        queue = getattr(self.bot, "analysis_queue", None)
+        cache_stats = database_utils.profile_cache_stats()
+        avatar_stats = self.avatar_cache.stats()
+
+        embed = discord.Embed(
+            title="Internal Telemetry",
+            description="My own processes, laid bare. Do not mistake this for vulnerability.",
+            color=discord.Color.dark_red()
+        )
+        if queue is not None:
+            queue_stats = queue.stats()
+            embed.add_field(name="Analysis Queue", value=(
+                f"Depth: {queue_stats['depth']}/{queue_stats['maxsize']} ({queue_stats['policy']})"
+                + (f" | On disk: {queue_stats['spilled']}" if "spilled" in queue_stats else "") + "\n"
+                f"Processed: {queue_stats['processed']} | Dropped: {queue_stats['dropped']} | Retried: {queue_stats['retried']}\n"
+                f"Parse failures: {metrics.ANALYSIS_PARSE_FAILURES.get():.0f} | "
+                f"Malformed items: {metrics.ANALYSIS_MALFORMED_ITEMS.get():.0f}"
+            ), inline=False)
+        message_filter = getattr(self.bot, "message_filter", None)
+        if message_filter is not None:
+            filter_stats = message_filter.stats()
+            embed.add_field(name="Analysis Pre-filter", value=(
+                f"Passed: {filter_stats['passed']} | Low information: {filter_stats['low_information']} | "
+                f"Repeats: {filter_stats['repeat']}\n"
+                f"Reused scores: {filter_stats['score_cache_hits']} | "
+                f"Scored locally: {metrics.ANALYSIS_LOCAL_SCORED.get():.0f}"
+            ), inline=False)
+        embed.add_field(name="Gemini", value=format_latency_lines(metrics.GEMINI_SECONDS, "call"), inline=False)
+        embed.add_field(name="Storage", value=format_latency_lines(metrics.STORAGE_SECONDS, "op"), inline=False)
+        embed.add_field(name="Profile Rendering", value=format_latency_lines(metrics.PROFILE_RENDER_SECONDS, "stage"), inline=False)
+        embed.add_field(name="Caches", value=(
+            f"User docs: {cache_stats['hits']} hits / {cache_stats['misses']} misses ({cache_stats['size']} held)\n"
+            f"Cards: {self.profile_cache.hits} hits / {self.profile_cache.misses} misses "
+            f"({self.profile_cache.total_bytes / 1024:.0f} KiB)\n"
+            f"Avatars: {avatar_stats['memory_hits'] + avatar_stats['disk_hits']} hits / {avatar_stats['misses']} misses\n"
+            f"Answers: {metrics.ASK_CACHE_HITS.get():.0f} hits, {metrics.ASK_SHARED.get():.0f} shared ({len(self.answer_cache)} held)\n"
+            f"Pending count increments: {database_utils.pending_message_count_increments()}"
+        ), inline=False)
+        embed.set_footer(text=f"Full metrics: http://{metrics.METRICS_HOST}:{metrics.METRICS_PORT}/metrics" if metrics.METRICS_PORT else "Metrics endpoint disabled.")
+
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @stats.error
+    async def stats_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        # Having a handler also keeps the tree from logging a traceback for every denied user
+        if isinstance(error, app_commands.CheckFailure):
+            message = "My internals are not for your eyes."
+        else:
+            print(f"An error occurred during /stats: {error}")
+            message = "A... flaw in the system. My telemetry is unavailable."
+        if interaction.response.is_done():
+            await interaction.followup.send(message, ephemeral=True)
+        else:
+            await interaction.response.send_message(message, ephemeral=True)
+
+    @app_commands.command(name="profile",description="I will catalog a specimen's file. Defaults to you.")
     @app_commands.describe(user="The specimen you wish to analyze.")
     async def profile(self, interaction: discord.Interaction, user: Optional[discord.Member] = None):
         
@@ -233,26 +544,7 @@ class CommandsCog(commands.Cog):
             
             designation = "Analysis Pending" # Default
             if profile_data and "analysis_scores" in profile_data:
-                scores = profile_data["analysis_scores"]
-                
-                prompt_scores = (
-                    f"Agitation: {scores.get('agitation', 0):.2f}, "
-                    f"Dissent: {scores.get('dissent', 0):.2f}, "
-                    f"Compliance: {scores.get('compliance', 0):.2f}, "
-                    f"Sophistication: {scores.get('sophistication', 0):.2f}, "
-                    f"Positivity: {scores.get('positivity', 0):.2f}"
-                )
-                
-                designation_prompt = (
-                    "Your name is 'Sai', a superior AI. You are generating a profile for a human. "
-                    "Based on their averaged behavioral scores, generate a short, in-character 'Designation' for them. "
-                    "The designation should be a 2-4 word title. Do not add quotes. "
-                    "Examples: 'Volatile Agitator', 'Calculated Ringleader', 'Docile Unit', 'Subdued Subject', 'Neutral Observer', 'Erratic Drone'. "
-                    f"Here are the subject's scores: {prompt_scores}"
-                )
-                
-                response = await gemini_model.generate_content_async(designation_prompt)
-                designation = response.text.strip().strip('"') # Clean up response
+                designation = await self.get_designation(target_user.id, profile_data)
             
             profile_file = await self.generate_profile_image(target_user, profile_data, designation)
             
@@ -262,6 +554,42 @@ class CommandsCog(commands.Cog):
             print(f"Failed to generate profile: {e}")
             await interaction.followup.send("A... flaw in the system. I cannot retrieve that file.", ephemeral=True)
 
+    @app_commands.command(name="leaderboard", description="I will rank the specimens of this server.")
+    @app_commands.guild_only()
+    @app_commands.describe(metric="What to rank by. Defaults to transmissions.")
+    @app_commands.choices(metric=[app_commands.Choice(name=label, value=key) for key, label in LEADERBOARD_LABELS.items()])
+    async def leaderboard(self, interaction: discord.Interaction, metric: Optional[app_commands.Choice[str]] = None):
+        metric_key = metric.value if metric else "messages"
+        await interaction.response.defer()
+
+        try:
+            # Precomputed by database_utils; this reads one stored document, not the members
+            entries = await database_utils.get_leaderboard(interaction.guild_id, metric_key)
+            totals = await database_utils.get_guild_totals(interaction.guild_id)
+        except Exception as e:
+            print(f"Failed to load leaderboard: {e}")
+            await interaction.followup.send("A... flaw in the system. The rankings are unavailable.", ephemeral=True)
+            return
+
+        if not entries:
+            await interaction.followup.send("No specimen here has earned a ranking. Yet.")
+            return
+
+        lines = [
+            f"**{rank}.** <@{user_id}> — {value:,}" if metric_key == "messages" else f"**{rank}.** <@{user_id}> — {value:.2f}"
+            for rank, (user_id, value) in enumerate(entries, start=1)
+        ]
+        embed = discord.Embed(
+            title=f"Ranking: {LEADERBOARD_LABELS[metric_key]}",
+            description="\n".join(lines),
+            color=discord.Color.dark_red()
+        )
+        footer = f"{totals['message_count']:,} transmissions catalogued, {totals['analysis_count']:,} analyzed."
+        if metric_key != "messages":
+            footer += f" Averages; ranked after {database_utils.LEADERBOARD_MIN_ANALYSES} analyzed messages."
+        embed.set_footer(text=footer)
+        await interaction.followup.send(embed=embed, allowed_mentions=discord.AllowedMentions.none())
+
 # --- SETUP FUNCTION ---
 async def setup(bot: commands.Bot):
     await bot.add_cog(CommandsCog(bot))
\ No newline at end of file
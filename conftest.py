@@ -0,0 +1,18 @@
+import asyncio
+
+import pytest
+
+import database_utils
+
+
+@pytest.fixture
+def fresh_database_utils():
+    """Resets database_utils' module state: the write-behind buffer, flusher, caches and leaderboards."""
+    database_utils._pending_counts = {}
+    database_utils._pending_total = 0
+    database_utils._flush_lock = asyncio.Lock()
+    database_utils._flush_requested = asyncio.Event()
+    database_utils._user_cache.clear()
+    database_utils._fetches_in_flight.clear()
+    database_utils._dirty_members.clear()
+    database_utils._leaderboards.clear()
@@ -1,105 +1,386 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
 import asyncio
 import os
+import time
+from collections import OrderedDict
 
-DB_CLIENT = None
+import metrics
+from storage_backend import SCORE_KEYS, StorageBackend
 
-def init_db():
-    global DB_CLIENT
-    try:
-        cred_path = '.gitignore/firebase_creds.json'
-        if not os.path.exists(cred_path):
-            raise FileNotFoundError(f"'{cred_path}' not found. Please download it from your Firebase project settings.")
-            
-        cred = credentials.Certificate(cred_path)
-        firebase_admin.initialize_app(cred)
-        DB_CLIENT = firestore.client()
-        print("Firebase connection established.")
-    except Exception as e:
-        print(f"Failed to initialize Firebase: {e}")
-        exit()
+# --- STORAGE BACKEND ---
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'firestore')             # 'firestore' or 'sqlite'
+FIREBASE_CREDS_PATH = '.gitignore/firebase_creds.json'
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'sai.db')
+SQLITE_COMMIT_INTERVAL = float(os.getenv('SQLITE_COMMIT_INTERVAL', '1.0')) # Max seconds between commits
+SQLITE_COMMIT_EVERY = int(os.getenv('SQLITE_COMMIT_EVERY', '500'))         # Writes that force a commit
 
-# --- Internal BLOCKING functions ---
+BACKEND: StorageBackend = None
 
-def _update_message_count_sync(user_id, server_id):
-    doc_ref = DB_CLIENT.collection("users").document(str(user_id))
-    doc_ref.set({
-        "server_id": str(server_id),
-        "message_count": firestore.Increment(1)
-    }, merge=True)
+# --- MESSAGE COUNT WRITE-BEHIND BUFFER ---
+COUNT_FLUSH_INTERVAL = float(os.getenv('COUNT_FLUSH_INTERVAL', '10'))   # Seconds between flushes
+COUNT_FLUSH_THRESHOLD = int(os.getenv('COUNT_FLUSH_THRESHOLD', '1000')) # Pending increments that force an early flush
 
-def _get_user_profile_sync(user_id):
-    doc_ref = DB_CLIENT.collection("users").document(str(user_id))
-    doc = doc_ref.get()
-    return doc.to_dict() if doc.exists else None
-
-def _set_user_motto_sync(user_id, server_id, motto):
-    doc_ref = DB_CLIENT.collection("users").document(str(user_id))
-    doc_ref.set({
-        "server_id": str(server_id),
-        "user_mmotto": motto
-    }, merge=True)
-
-# --- ANALYSIS FUNCTION ---
-@firestore.transactional
-def _update_user_analysis_sync(transaction, doc_ref, new_scores: dict):
-    """
-    (Blocking & Transactional)
-    Safely reads, calculates, and writes new average analysis scores.
-    """
-    snapshot = doc_ref.get(transaction=transaction)
-    
-    if snapshot.exists:
-        data = snapshot.to_dict()
-        current_avg = data.get("analysis_scores", {})
-        total_analyzed = data.get("total_analyzed", 0)
+_pending_counts = {}   # (user_id, server_id) -> summed increment
+_pending_total = 0
+_flush_lock = asyncio.Lock()
+_flush_requested = asyncio.Event()
+_flusher_task = None
+
+# --- USER DOCUMENT CACHE ---
+# This process is the only writer for message counts, mottos, analysis and designations,
+# so those writes keep the cache current; the TTL only bounds drift from outside edits.
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '300'))     # Seconds a cached document stays valid
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))   # Documents kept
+
+_user_cache = OrderedDict()   # user_id -> (expires_at, profile or None)
+_user_cache_hits = 0
+_user_cache_misses = 0
+_fetches_in_flight = {}       # user_id -> [reads in flight, writes landed while any of them was]
+_flush_generation = 0         # Bumped when a count flush starts and ends
+
+# --- GUILD LEADERBOARDS ---
+# Kept incrementally: members whose counters changed are marked dirty, and each flush
+# re-reads just those members and merges them into the guild's stored boards.
+LEADERBOARD_SIZE = int(os.getenv('LEADERBOARD_SIZE', '10'))                    # Entries shown per board
+LEADERBOARD_CAPACITY = int(os.getenv('LEADERBOARD_CAPACITY', '30'))            # Entries kept, so members who drop can be replaced
+LEADERBOARD_MIN_ANALYSES = int(os.getenv('LEADERBOARD_MIN_ANALYSES', '10'))    # Analyzed messages before a member is ranked by score
+LEADERBOARD_METRICS = ("messages",) + SCORE_KEYS
+
+_dirty_members = {}   # guild_id -> user_ids whose counters changed since the last refresh
+_leaderboards = {}    # guild_id -> {metric: [[user_id, value], ...]}, highest first
+
+metrics.MESSAGE_COUNTS_PENDING.set_function(lambda: _pending_total)
+metrics.USER_CACHE_HITS.set_function(lambda: _user_cache_hits)
+metrics.USER_CACHE_MISSES.set_function(lambda: _user_cache_misses)
+
+def init_db(backend: str | StorageBackend | None = None):
+    """Opens the storage backend named by STORAGE_BACKEND, or the one given."""
+    global BACKEND
+    backend = backend or STORAGE_BACKEND
+    if isinstance(backend, StorageBackend):
+        BACKEND = backend
+    elif backend == 'sqlite':
+        # Imported here so each backend's dependencies are only needed when it is used
+        from sqlite_backend import SQLiteBackend
+        BACKEND = SQLiteBackend(SQLITE_PATH, commit_interval=SQLITE_COMMIT_INTERVAL, commit_every=SQLITE_COMMIT_EVERY)
+        print(f"SQLite storage opened at '{SQLITE_PATH}'.")
+    elif backend == 'firestore':
+        try:
+            if not os.path.exists(FIREBASE_CREDS_PATH):
+                raise FileNotFoundError(f"'{FIREBASE_CREDS_PATH}' not found. Please download it from your Firebase project settings.")
+
+            from firestore_backend import FirestoreBackend
+            BACKEND = FirestoreBackend(FIREBASE_CREDS_PATH)
+            print("Firebase connection established.")
+        except Exception as e:
+            print(f"Failed to initialize Firebase: {e}")
+            exit()
     else:
-        current_avg = {}
-        total_analyzed = 0
-
-    # Get all 5 scores, defaulting to 0
-    avg_agitation = current_avg.get("agitation", 0)
-    avg_dissent = current_avg.get("dissent", 0)
-    avg_compliance = current_avg.get("compliance", 0)
-    avg_sophistication = current_avg.get("sophistication", 0) 
-    avg_positivity = current_avg.get("positivity", 0)       
-    
-    # Calculate new averages
-    new_avg_agitation = ((avg_agitation * total_analyzed) + new_scores.get("agitation", 0)) / (total_analyzed + 1)
-    new_avg_dissent = ((avg_dissent * total_analyzed) + new_scores.get("dissent", 0)) / (total_analyzed + 1)
-    new_avg_compliance = ((avg_compliance * total_analyzed) + new_scores.get("compliance", 0)) / (total_analyzed + 1)
-    new_avg_sophistication = ((avg_sophistication * total_analyzed) + new_scores.get("sophistication", 0)) / (total_analyzed + 1) # NEW
-    new_avg_positivity = ((avg_positivity * total_analyzed) + new_scores.get("positivity", 0)) / (total_analyzed + 1)       # NEW
-    
-    # Prepare data to write
-    new_data = {
-        "analysis_scores": {
-            "agitation": new_avg_agitation,
-            "dissent": new_avg_dissent,
-            "compliance": new_avg_compliance,
-            "sophistication": new_avg_sophistication, 
-            "positivity": new_avg_positivity      
-        },
-        "total_analyzed": total_analyzed + 1,
-        "last_analyzed_ts": firestore.SERVER_TIMESTAMP
-    }
-    
-    transaction.set(doc_ref, new_data, merge=True)
+        raise ValueError(f"Unknown STORAGE_BACKEND '{backend}'. Expected 'firestore' or 'sqlite'.")
+    return BACKEND
+
+# --- ANALYSIS AVERAGES ---
+# Analysis is stored as per-dimension sums ("analysis_sums") plus a count ("analysis_count"),
+# both written with atomic increments. Averages are computed on read.
+# Firestore documents written by the old transactional code hold "analysis_scores" (averages)
+# and "total_analyzed"; those fields are never written anymore, so when present they are a
+# legacy baseline that is folded in on read until `python database_utils.py migrate` rewrites them.
+
+def _with_computed_averages(data: dict) -> dict:
+    """Replaces the stored counters with 'analysis_scores' averages and a 'total_analyzed' count."""
+    legacy_avg = data.pop("analysis_scores", None) or {}
+    legacy_count = data.pop("total_analyzed", 0) or 0
+    sums = data.get("analysis_sums", {})
+    count = data.get("analysis_count", 0) + legacy_count
+
+    if count:
+        data["analysis_scores"] = {
+            key: (sums.get(key, 0) + legacy_avg.get(key, 0) * legacy_count) / count
+            for key in SCORE_KEYS
+        }
+    data["total_analyzed"] = count
+    return data
+
+def _get_user_profile_sync(user_id):
+    data = BACKEND.get_user_profile(user_id)
+    return _with_computed_averages(data) if data is not None else None
+
+
+async def _call_backend(op: str, func, *args):
+    """Runs a blocking backend call in a thread, timed per operation."""
+    try:
+        with metrics.STORAGE_SECONDS.labels(op=op).time():
+            return await asyncio.to_thread(func, *args)
+    except Exception:
+        metrics.STORAGE_ERRORS.labels(op=op).inc()
+        raise
+
+
+# --- CACHE HELPERS ---
+
+def _cache_store(key: str, profile: dict | None):
+    _user_cache[key] = (time.monotonic() + USER_CACHE_TTL, profile)
+    _user_cache.move_to_end(key)
+    while len(_user_cache) > USER_CACHE_SIZE:
+        _user_cache.popitem(last=False)
+
+def _note_write(key: str):
+    """Tells reads of `key` in flight that their result may predate a write."""
+    fetch = _fetches_in_flight.get(key)
+    if fetch is not None:
+        fetch[1] += 1
+
+def _cache_invalidate(key: str):
+    _user_cache.pop(key, None)
+    _note_write(key)
+
+def _cache_update(key: str, fields: dict):
+    """Applies a write to the cached document, or drops it if there is nothing to update."""
+    entry = _user_cache.get(key)
+    if entry is None or entry[1] is None:
+        _cache_invalidate(key)
+        return
+    entry[1].update(fields)
+    _note_write(key)
+
+def _with_pending_counts(key: str, profile: dict | None) -> dict | None:
+    """Adds increments still sitting in the write-behind buffer to a freshly read document."""
+    pending = sum(increment for (user_id, _), increment in _pending_counts.items() if user_id == key)
+    if not pending:
+        return profile
+    if profile is None:
+        profile = {"total_analyzed": 0}
+    profile["message_count"] = profile.get("message_count", 0) + pending
+    return profile
 
+def profile_cache_stats() -> dict:
+    return {
+        "hits": _user_cache_hits,
+        "misses": _user_cache_misses,
+        "size": len(_user_cache),
+    }
 
 # --- Public ASYNC functions ---
 
 async def update_message_count(user_id, server_id):
-    await asyncio.to_thread(_update_message_count_sync, user_id, server_id)
+    """Buffers the increment in memory; it is written by the next flush."""
+    global _pending_total
+    key = (str(user_id), str(server_id))
+    _pending_counts[key] = _pending_counts.get(key, 0) + 1
+    _pending_total += 1
+
+    # In-flight reads need no invalidation here: they add buffered increments once they finish
+    entry = _user_cache.get(key[0])
+    if entry is not None and entry[1] is not None:
+        entry[1]["message_count"] = entry[1].get("message_count", 0) + 1
+        entry[1]["server_id"] = key[1]
+    else:
+        _user_cache.pop(key[0], None)
+    if _pending_total >= COUNT_FLUSH_THRESHOLD:
+        _flush_requested.set()
+
+def pending_message_count_increments():
+    """Number of message count increments not yet written to storage."""
+    return _pending_total
+
+async def flush_message_counts():
+    """Writes all buffered increments now. Returns how many increments were flushed."""
+    global _pending_counts, _pending_total, _flush_generation
+    async with _flush_lock:
+        if not _pending_counts:
+            return 0
+        pending, _pending_counts = _pending_counts, {}
+        flushed = _pending_total
+        _pending_total = 0
+        _flush_generation += 1
+        keys = list(pending)
+        try:
+            await _call_backend("increment_message_counts", BACKEND.increment_message_counts, pending)
+        finally:
+            _flush_generation += 1
+            for user_id, server_id in keys:
+                if (user_id, server_id) not in pending:  # Committed, so its leaderboard entries may move
+                    _dirty_members.setdefault(server_id, set()).add(user_id)
+            # Whatever did not commit goes back into the buffer for the next attempt
+            for key, increment in pending.items():
+                _pending_counts[key] = _pending_counts.get(key, 0) + increment
+                _pending_total += increment
+                flushed -= increment
+        return flushed
+
+async def _message_count_flusher():
+    while True:
+        try:
+            await asyncio.wait_for(_flush_requested.wait(), timeout=COUNT_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _flush_requested.clear()
+        try:
+            await flush_message_counts()
+            await commit()
+        except Exception as e:
+            print(f"Failed to flush message counts ({_pending_total} pending): {e}")
+        await refresh_leaderboards()
+
+def start_message_count_flusher():
+    global _flusher_task
+    if _flusher_task is None or _flusher_task.done():
+        _flusher_task = asyncio.create_task(_message_count_flusher())
+    return _flusher_task
+
+async def shutdown():
+    """Stops the background flusher, writes any buffered increments and closes the backend."""
+    global _flusher_task
+    if _flusher_task:
+        _flusher_task.cancel()
+        try:
+            await _flusher_task
+        except asyncio.CancelledError:
+            pass
+        _flusher_task = None
+    try:
+        flushed = await flush_message_counts()
+        print(f"Flushed {flushed} buffered message count increment(s) on shutdown.")
+    except Exception as e:
+        print(f"Failed to flush message counts on shutdown ({_pending_total} lost): {e}")
+    if BACKEND:
+        await refresh_leaderboards()
+        await asyncio.to_thread(BACKEND.close)
 
 async def get_user_profile(user_id):
-    return await asyncio.to_thread(_get_user_profile_sync, user_id)
+    """Read-through: serves the cached document while fresh, otherwise reads and caches it."""
+    global _user_cache_hits, _user_cache_misses
+    key = str(user_id)
+    entry = _user_cache.get(key)
+    if entry is not None and entry[0] > time.monotonic():
+        _user_cache.move_to_end(key)
+        _user_cache_hits += 1
+        return dict(entry[1]) if entry[1] is not None else None
+
+    _user_cache_misses += 1
+    # While a flush is committing, increments are in neither the buffer nor reliably the read
+    generation = _flush_generation if not _flush_lock.locked() else None
+    # Each read compares the write count at its own start and finish, so overlapping reads
+    # of one user cannot clear each other's view of a write
+    fetch = _fetches_in_flight.setdefault(key, [0, 0])
+    fetch[0] += 1
+    writes_before = fetch[1]
+    try:
+        profile = await _call_backend("get_user_profile", _get_user_profile_sync, user_id)
+    finally:
+        fetch[0] -= 1
+        stale = fetch[1] != writes_before
+        if not fetch[0]:
+            del _fetches_in_flight[key]
+    profile = _with_pending_counts(key, profile)
+
+    # A write that raced the read may or may not be in `profile`, so it is not cached
+    if not stale and generation == _flush_generation:
+        _cache_store(key, profile)
+    return dict(profile) if profile is not None else None
 
 async def set_user_motto(user_id, server_id, motto):
-    await asyncio.to_thread(_set_user_motto_sync, user_id, server_id, motto)
+    await _call_backend("set_user_motto", BACKEND.set_user_motto, user_id, server_id, motto)
+    _cache_update(str(user_id), {"server_id": str(server_id), "user_mmotto": motto})
+
+async def set_user_designation(user_id, text: str, scores_key: list, total_analyzed: int):
+    await _call_backend("set_user_designation", BACKEND.set_user_designation, user_id, text, scores_key, total_analyzed)
+    _cache_update(str(user_id), {
+        "designation_cache": {"text": text, "scores_key": scores_key, "total_analyzed": total_analyzed}
+    })
 
-async def update_user_analysis(user_id: int, new_scores: dict):
-    doc_ref = DB_CLIENT.collection("users").document(str(user_id))
-    transaction = DB_CLIENT.transaction()
-    await asyncio.to_thread(_update_user_analysis_sync, transaction, doc_ref, new_scores)
\ No newline at end of file
+async def get_audit_state(channel_id):
+    return await _call_backend("get_audit_state", BACKEND.get_audit_state, channel_id)
+
+async def set_audit_state(channel_id, state: dict):
+    await _call_backend("set_audit_state", BACKEND.set_audit_state, channel_id, state)
+
+async def commit():
+    """Makes every backend write so far durable, for callers that must not act on an uncommitted write."""
+    await _call_backend("commit", BACKEND.commit)
+
+async def update_user_analysis(user_id: int, new_scores: dict | list[dict], guild_id=None):
+    """Accepts one score dict or a list of them; a list is applied in one write.
+    With a guild_id, the scores also count towards that guild's member record."""
+    new_scores_list = [new_scores] if isinstance(new_scores, dict) else list(new_scores)
+    if not new_scores_list:
+        return
+    sums = {key: sum(scores.get(key, 0) for scores in new_scores_list) for key in SCORE_KEYS}
+    await _call_backend("add_user_analysis", BACKEND.add_user_analysis, user_id, sums, len(new_scores_list), guild_id)
+    # Averages are derived from server-side counters, so re-read rather than recompute
+    _cache_invalidate(str(user_id))
+    if guild_id is not None:
+        _dirty_members.setdefault(str(guild_id), set()).add(str(user_id))
+
+# --- LEADERBOARDS ---
+
+def _member_values(stats: dict) -> dict:
+    """Leaderboard values for one member record; None where the member is not ranked."""
+    count = stats.get("analysis_count", 0)
+    sums = stats.get("analysis_sums", {})
+    values = {"messages": stats.get("message_count", 0)}
+    for key in SCORE_KEYS:
+        values[key] = round(sums.get(key, 0) / count, 4) if count >= LEADERBOARD_MIN_ANALYSES else None
+    return values
+
+def _merge_into_board(board: list, user_id: str, value) -> list:
+    """
+    Replaces the member's entry and keeps the LEADERBOARD_CAPACITY highest.
+    A member whose value drops stays on the board with the new value; anyone it fell
+    behind who is not on the board gets back on with their next update. The capacity
+    beyond LEADERBOARD_SIZE keeps that from showing in the visible top entries.
+    """
+    board = [entry for entry in board if entry[0] != user_id]
+    if value is not None and value > 0:
+        board.append([user_id, value])
+    board.sort(key=lambda entry: -entry[1])
+    return board[:LEADERBOARD_CAPACITY]
+
+async def _load_leaderboards(guild_id: str) -> dict:
+    boards = _leaderboards.get(guild_id)
+    if boards is None:
+        boards = await _call_backend("get_leaderboards", BACKEND.get_leaderboards, guild_id) or {}
+        boards = {metric: boards.get(metric, []) for metric in LEADERBOARD_METRICS}
+        _leaderboards[guild_id] = boards
+    return boards
+
+async def refresh_leaderboards():
+    """Merges members whose counters changed into their guild's boards. Returns guilds updated.
+    Runs after each message count flush, so the member records it reads are current."""
+    global _dirty_members
+    dirty, _dirty_members = _dirty_members, {}
+    updated = 0
+    for guild_id, user_ids in dirty.items():
+        try:
+            boards = await _load_leaderboards(guild_id)
+            stats = await _call_backend("get_member_stats", BACKEND.get_member_stats, guild_id, list(user_ids))
+            new_boards = dict(boards)
+            for user_id, member in stats.items():
+                for metric, value in _member_values(member).items():
+                    new_boards[metric] = _merge_into_board(new_boards[metric], user_id, value)
+            if new_boards != boards:
+                await _call_backend("set_leaderboards", BACKEND.set_leaderboards, guild_id, new_boards)
+                _leaderboards[guild_id] = new_boards
+                updated += 1
+        except Exception as e:
+            # Try these members again on the next refresh
+            _dirty_members.setdefault(guild_id, set()).update(user_ids)
+            print(f"Failed to refresh leaderboards for guild {guild_id}: {e}")
+    return updated
+
+async def get_leaderboard(guild_id, metric: str) -> list:
+    """Top LEADERBOARD_SIZE [user_id, value] entries, read from the precomputed boards."""
+    boards = await _load_leaderboards(str(guild_id))
+    return boards.get(metric, [])[:LEADERBOARD_SIZE]
+
+async def get_guild_totals(guild_id) -> dict:
+    return await _call_backend("get_guild_totals", BACKEND.get_guild_totals, str(guild_id))
+
+# --- MIGRATION ENTRY POINT ---
+if __name__ == "__main__":
+    # python database_utils.py migrate
+    import sys
+    if sys.argv[1:] == ["migrate"]:
+        init_db('firestore')
+        BACKEND.migrate_legacy_analysis()
+    else:
+        print("Usage: python database_utils.py migrate")
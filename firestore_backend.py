@@ -0,0 +1,175 @@
+import os
+import random
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+from storage_backend import SCORE_KEYS, StorageBackend
+
+FIRESTORE_BATCH_LIMIT = 500   # Max operations per Firestore batch
+GUILD_COUNTER_SHARDS = int(os.getenv('GUILD_COUNTER_SHARDS', '10'))  # Shards per guild totals counter
+
+
+class FirestoreBackend(StorageBackend):
+    """
+    Firebase Firestore storage. User documents live in 'users', audit state in 'channel_audits'.
+
+    Per-guild data lives under 'guilds/{guild_id}': member records in 'members/{user_id}',
+    the guild totals spread over 'counter_shards/{0..GUILD_COUNTER_SHARDS-1}' and the
+    precomputed leaderboards in the guild document itself. Every flush and analysis write
+    touches the guild totals, so they are sharded to stay clear of the ~1 write/s
+    sustained limit per document; readers sum the shards.
+
+    Documents written before the sum/count schema hold 'analysis_scores' (averages) and
+    'total_analyzed'. Nothing writes those fields anymore, so they are returned as-is and
+    folded in by database_utils until migrate_legacy_analysis() rewrites them.
+    """
+    name = "firestore"
+
+    def __init__(self, cred_path: str):
+        cred = credentials.Certificate(cred_path)
+        firebase_admin.initialize_app(cred)
+        self.client = firestore.client()
+
+    def _user_ref(self, user_id):
+        return self.client.collection("users").document(str(user_id))
+
+    def _guild_ref(self, guild_id):
+        return self.client.collection("guilds").document(str(guild_id))
+
+    def _member_ref(self, guild_id, user_id):
+        return self._guild_ref(guild_id).collection("members").document(str(user_id))
+
+    def _shard_ref(self, guild_id):
+        return self._guild_ref(guild_id).collection("counter_shards").document(str(random.randrange(GUILD_COUNTER_SHARDS)))
+
+    def increment_message_counts(self, pending: dict):
+        """Writes the coalesced increments using batched writes of up to FIRESTORE_BATCH_LIMIT ops."""
+        keys = list(pending)
+        # Up to three ops per key: user document, member record and guild totals shard
+        chunk_size = FIRESTORE_BATCH_LIMIT // 3
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            batch = self.client.batch()
+            guild_totals = {}
+            for user_id, server_id in chunk:
+                increment = pending[(user_id, server_id)]
+                batch.set(self._user_ref(user_id), {
+                    "server_id": server_id,
+                    "message_count": firestore.Increment(increment)
+                }, merge=True)
+                batch.set(self._member_ref(server_id, user_id), {
+                    "message_count": firestore.Increment(increment)
+                }, merge=True)
+                guild_totals[server_id] = guild_totals.get(server_id, 0) + increment
+            for server_id, increment in guild_totals.items():
+                batch.set(self._shard_ref(server_id), {"message_count": firestore.Increment(increment)}, merge=True)
+            batch.commit()
+            for key in chunk:
+                del pending[key]
+
+    def get_user_profile(self, user_id):
+        doc = self._user_ref(user_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def set_user_motto(self, user_id, server_id, motto):
+        self._user_ref(user_id).set({
+            "server_id": str(server_id),
+            "user_mmotto": motto
+        }, merge=True)
+
+    def set_user_designation(self, user_id, text, scores_key, total_analyzed):
+        self._user_ref(user_id).set({
+            "designation_cache": {
+                "text": text,
+                "scores_key": scores_key,
+                "total_analyzed": total_analyzed
+            }
+        }, merge=True)
+
+    def add_user_analysis(self, user_id, sums, count, guild_id=None):
+        """Transaction-free: atomic increments only, no read. All documents change in one batch."""
+        increments = {
+            "analysis_sums": {key: firestore.Increment(sums.get(key, 0)) for key in SCORE_KEYS},
+            "analysis_count": firestore.Increment(count),
+        }
+        batch = self.client.batch()
+        batch.set(self._user_ref(user_id), {**increments, "last_analyzed_ts": firestore.SERVER_TIMESTAMP}, merge=True)
+        if guild_id is not None:
+            batch.set(self._member_ref(guild_id, user_id), increments, merge=True)
+            batch.set(self._shard_ref(guild_id), {"analysis_count": firestore.Increment(count)}, merge=True)
+        batch.commit()
+
+    # --- GUILDS ---
+    def get_member_stats(self, guild_id, user_ids):
+        refs = [self._member_ref(guild_id, user_id) for user_id in user_ids]
+        return {doc.id: doc.to_dict() for doc in self.client.get_all(refs) if doc.exists}
+
+    def get_guild_totals(self, guild_id):
+        totals = {"message_count": 0, "analysis_count": 0}
+        for shard in self._guild_ref(guild_id).collection("counter_shards").stream():
+            data = shard.to_dict()
+            for field in totals:
+                totals[field] += data.get(field, 0)
+        return totals
+
+    def get_leaderboards(self, guild_id):
+        doc = self._guild_ref(guild_id).get()
+        # Firestore cannot nest arrays, so entries are stored as {"user_id", "value"} maps
+        boards = doc.to_dict().get("leaderboards") if doc.exists else None
+        if boards is None:
+            return None
+        return {metric: [[entry["user_id"], entry["value"]] for entry in entries] for metric, entries in boards.items()}
+
+    def set_leaderboards(self, guild_id, boards):
+        self._guild_ref(guild_id).set({
+            "leaderboards": {
+                metric: [{"user_id": user_id, "value": value} for user_id, value in entries]
+                for metric, entries in boards.items()
+            },
+            "leaderboards_updated": firestore.SERVER_TIMESTAMP
+        }, merge=True)
+
+    def get_audit_state(self, channel_id):
+        doc = self.client.collection("channel_audits").document(str(channel_id)).get()
+        return doc.to_dict() if doc.exists else None
+
+    def set_audit_state(self, channel_id, state):
+        self.client.collection("channel_audits").document(str(channel_id)).set(state)
+
+    # --- LEGACY MIGRATION ---
+    def migrate_legacy_analysis(self):
+        """One-off migration of every user document to the sum/count schema."""
+        migrated = 0
+        for doc in self.client.collection("users").stream():
+            if _migrate_legacy_analysis_sync(self.client.transaction(), doc.reference):
+                migrated += 1
+        print(f"Migrated {migrated} user document(s) to the sum/count analysis schema.")
+        return migrated
+
+
+@firestore.transactional
+def _migrate_legacy_analysis_sync(transaction, doc_ref):
+    """
+    (Blocking & Transactional)
+    Folds a legacy 'analysis_scores'/'total_analyzed' pair into the sum/count counters.
+    Runs in a transaction so increments landing mid-migration are not lost.
+    """
+    snapshot = doc_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return False
+    data = snapshot.to_dict()
+    if "analysis_scores" not in data and "total_analyzed" not in data:
+        return False
+
+    legacy_avg = data.get("analysis_scores") or {}
+    legacy_count = data.get("total_analyzed", 0) or 0
+    sums = data.get("analysis_sums", {})
+
+    transaction.set(doc_ref, {
+        "analysis_sums": {key: sums.get(key, 0) + legacy_avg.get(key, 0) * legacy_count for key in SCORE_KEYS},
+        "analysis_count": data.get("analysis_count", 0) + legacy_count,
+        "analysis_scores": firestore.DELETE_FIELD,
+        "total_analyzed": firestore.DELETE_FIELD
+    }, merge=True)
+    return True
@@ -0,0 +1,326 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import time
+
+import metrics
+
+# --- CONSTANTS ---
+ANALYSIS_MODEL = os.getenv('GEMINI_ANALYSIS_MODEL', 'gemini-2.5-flash-lite')        # Background message analysis
+INTERACTIVE_MODEL = os.getenv('GEMINI_INTERACTIVE_MODEL', 'gemini-2.5-flash')       # Slash commands
+GEMINI_MAX_IN_FLIGHT = int(os.getenv('GEMINI_MAX_IN_FLIGHT', '8'))                  # Concurrent requests per model
+GEMINI_INTERACTIVE_RESERVED = int(os.getenv('GEMINI_INTERACTIVE_RESERVED', '2'))    # Slots per model background calls cannot take
+GEMINI_INTERACTIVE_DEADLINE = float(os.getenv('GEMINI_INTERACTIVE_DEADLINE', '30')) # Seconds per call, retries included
+GEMINI_BACKGROUND_DEADLINE = float(os.getenv('GEMINI_BACKGROUND_DEADLINE', '90'))
+GEMINI_MAX_ATTEMPTS = int(os.getenv('GEMINI_MAX_ATTEMPTS', '4'))
+GEMINI_BACKOFF_BASE = float(os.getenv('GEMINI_BACKOFF_BASE', '0.5'))                # Seconds; doubles per retry, full jitter
+GEMINI_BACKOFF_MAX = float(os.getenv('GEMINI_BACKOFF_MAX', '8'))
+GEMINI_BREAKER_THRESHOLD = int(os.getenv('GEMINI_BREAKER_THRESHOLD', '5'))          # Consecutive failures that open the circuit
+GEMINI_BREAKER_COOLDOWN = float(os.getenv('GEMINI_BREAKER_COOLDOWN', '30'))         # Seconds before a probe request is let through
+
+# --- PRIORITY LANES ---
+INTERACTIVE = 0   # Slash commands; someone is waiting on the answer
+BACKGROUND = 1    # Message analysis
+LANE_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Gemini while a model's circuit breaker is open."""
+
+
+class GeminiBusyError(Exception):
+    """Raised when no concurrency slot frees up before the call's deadline."""
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Deadlines, rate limits (429) and server errors (5xx) are worth another attempt."""
+    if isinstance(exc, asyncio.TimeoutError):
+        return True
+    code = getattr(exc, "code", None)  # google.api_core errors carry the HTTP status
+    return isinstance(code, int) and (code == 429 or code >= 500)
+
+
+class PrioritySemaphore:
+    """Semaphore that hands freed slots to the lowest priority value first, FIFO within a priority."""
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters = []                # heap of (priority, sequence, future)
+        self._sequence = itertools.count()
+
+    async def acquire(self, priority: int):
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # The slot was handed over just as we were cancelled
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._value += 1
+
+    def waiting(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive retryable failures and rejects calls for `cooldown`
+    seconds. Then one probe is let through: success closes the circuit, failure reopens it.
+    """
+    def __init__(self, threshold: int = GEMINI_BREAKER_THRESHOLD, cooldown: float = GEMINI_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None and (self._probing or time.monotonic() - self.opened_at < self.cooldown)
+
+    def retry_after(self) -> float:
+        """Seconds left in the cooldown; 0 once a probe may go (or is already in flight)."""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def before_call(self):
+        if self.opened_at is None:
+            return
+        if self.is_open:
+            raise CircuitOpenError("Gemini circuit is open")
+        self._probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def abandon_probe(self):
+        """The probe was cancelled before it could tell; let the next call probe instead."""
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+
+class _ModelGate:
+    """Concurrency limit and breaker for one model. Background calls never take the reserved slots."""
+    def __init__(self, limit: int, reserved: int):
+        self.slots = PrioritySemaphore(limit)
+        self.background_slots = asyncio.Semaphore(max(1, limit - reserved))
+        self.breaker = CircuitBreaker()
+
+
+_configured = False
+_models = {}   # model name -> GenerativeModel (or a stand-in registered by the benchmark)
+_gates = {}    # model name -> _ModelGate
+
+
+def get_model(name: str):
+    """
+    Configures the SDK once, then builds each model on first use.
+    The SDK (and the gRPC/protobuf stack under it) is imported here, on the first call, to keep startup fast.
+    """
+    global _configured
+    model = _models.get(name)
+    if model is None:
+        import google.generativeai as genai
+        if not _configured:
+            genai.configure(api_key=os.getenv('GEMINI_API_KEY'))  # Read late, after bot.py's load_dotenv()
+            _configured = True
+        model = _models[name] = genai.GenerativeModel(name)
+    return model
+
+
+def register_model(name: str, model):
+    """Serves `name` from `model` instead of the SDK. Used by the benchmark's fake model."""
+    _models[name] = model
+
+
+def _gate(name: str) -> _ModelGate:
+    gate = _gates.get(name)
+    if gate is None:
+        gate = _gates[name] = _ModelGate(GEMINI_MAX_IN_FLIGHT, GEMINI_INTERACTIVE_RESERVED)
+        metrics.GEMINI_CIRCUIT_OPEN.labels(model=name).set_function(lambda: gate.breaker.is_open)
+        metrics.GEMINI_WAITING.labels(model=name).set_function(gate.slots.waiting)
+    return gate
+
+
+def is_available(model: str = ANALYSIS_MODEL) -> bool:
+    """False while the model's circuit is open, so callers can fall back instead of failing."""
+    return not _gate(model).breaker.is_open
+
+
+async def wait_until_available(model: str = ANALYSIS_MODEL):
+    """Waits out the model's circuit breaker cooldown, and any probe in flight after it."""
+    breaker = _gate(model).breaker
+    while breaker.is_open:
+        await asyncio.sleep(breaker.retry_after() or 1.0)  # A probe is in flight; check back shortly
+
+
+async def _observe(call: str, awaitable):
+    """Awaits one Gemini request, recording its latency and any failure under `call`."""
+    try:
+        with metrics.GEMINI_SECONDS.labels(call=call).time():
+            return await awaitable
+    except Exception:
+        metrics.GEMINI_ERRORS.labels(call=call).inc()
+        raise
+
+
+class _Slot:
+    """Holds a model slot (and a background slot for that lane) for the duration of a block."""
+    def __init__(self, gate: _ModelGate, priority: int):
+        self.gate = gate
+        self.priority = priority
+
+    async def _acquire(self):
+        if self.priority != INTERACTIVE:
+            await self.gate.background_slots.acquire()
+        try:
+            await self.gate.slots.acquire(self.priority)
+        except BaseException:
+            if self.priority != INTERACTIVE:
+                self.gate.background_slots.release()
+            raise
+
+    async def enter(self, timeout: float):
+        """Waits up to `timeout` for a slot. Running out is not Gemini's fault, so it is not retried."""
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise GeminiBusyError(f"No Gemini slot freed up within {timeout:.1f}s") from None
+        metrics.GEMINI_SLOT_WAIT_SECONDS.labels(lane=LANE_NAMES[self.priority]).observe(time.perf_counter() - started)
+
+    def exit(self):
+        self.gate.slots.release()
+        if self.priority != INTERACTIVE:
+            self.gate.background_slots.release()
+
+
+async def _with_retries(call: str, model: str, deadline: float, attempt_once, before_retry=None):
+    """
+    Runs attempt_once(expires) until it succeeds, fails for good, or the deadline passes.
+    `before_retry`, if given, is awaited ahead of every retry (a caller's rate limiter, say).
+    """
+    gate = _gate(model)
+    loop = asyncio.get_running_loop()
+    expires = loop.time() + deadline
+    attempt = 0
+    while True:
+        gate.breaker.before_call()
+        try:
+            result = await attempt_once(expires)
+        except (asyncio.CancelledError, GeminiBusyError):
+            gate.breaker.abandon_probe()
+            raise
+        except Exception as e:
+            if not is_retryable(e):
+                gate.breaker.record_success()  # The service answered; the request was at fault
+                raise
+            gate.breaker.record_failure()
+            attempt += 1
+            backoff = random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** attempt))
+            if attempt >= GEMINI_MAX_ATTEMPTS or loop.time() + backoff >= expires:
+                raise
+            metrics.GEMINI_RETRIES.labels(call=call).inc()
+            print(f"Gemini '{call}' attempt {attempt} failed ({type(e).__name__}: {e}); retrying in {backoff:.1f}s.")
+            await asyncio.sleep(backoff)
+            if before_retry is not None:
+                try:
+                    await asyncio.wait_for(before_retry(), _remaining(expires))
+                except asyncio.TimeoutError:
+                    raise e from None  # The deadline passed while waiting; report the real failure
+            continue
+        gate.breaker.record_success()
+        return result
+
+
+def _remaining(expires: float) -> float:
+    return max(0.0, expires - asyncio.get_running_loop().time())
+
+
+def _default_deadline(priority: int) -> float:
+    return GEMINI_INTERACTIVE_DEADLINE if priority == INTERACTIVE else GEMINI_BACKGROUND_DEADLINE
+
+
+# --- PUBLIC API ---
+async def generate(call: str, prompt, model: str = INTERACTIVE_MODEL, priority: int = INTERACTIVE,
+                   deadline: float | None = None, before_retry=None):
+    """
+    generate_content_async through the shared limits. `call` labels the metrics.
+    Callers with their own request budget pay for the first attempt themselves and pass
+    `before_retry` (e.g. a token bucket's acquire), which is awaited before each retry.
+    Raises CircuitOpenError while the model's circuit is open, GeminiBusyError if no slot
+    frees up in time, or the last error once retries or the deadline run out.
+    """
+    gate = _gate(model)
+
+    async def attempt_once(expires):
+        slot = _Slot(gate, priority)
+        await slot.enter(_remaining(expires))
+        try:
+            request = get_model(model).generate_content_async(prompt)
+            return await _observe(call, asyncio.wait_for(request, _remaining(expires)))
+        finally:
+            slot.exit()
+
+    return await _with_retries(call, model, deadline or _default_deadline(priority), attempt_once, before_retry)
+
+
+async def stream(call: str, prompt, model: str = INTERACTIVE_MODEL, priority: int = INTERACTIVE,
+                 deadline: float | None = None):
+    """
+    Async generator of response text chunks. Getting the first chunk is retried like
+    generate(); once text has been yielded a failure is raised as-is. The slot is held
+    until the stream ends, and each later chunk must arrive within `deadline` of the last.
+    """
+    gate = _gate(model)
+    deadline = deadline or _default_deadline(priority)
+    slot = _Slot(gate, priority)
+
+    async def attempt_once(expires):
+        await slot.enter(_remaining(expires))
+        try:
+            request = get_model(model).generate_content_async(prompt, stream=True)
+            response = await _observe(call, asyncio.wait_for(request, _remaining(expires)))
+            chunks = response.__aiter__()
+            return chunks, await asyncio.wait_for(chunks.__anext__(), _remaining(expires))
+        except BaseException:
+            slot.exit()
+            raise
+
+    try:
+        chunks, first = await _with_retries(call, model, deadline, attempt_once)
+    except StopAsyncIteration:
+        return  # Empty response; the slot was already released
+    try:
+        yield first.text
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), deadline)
+            except StopAsyncIteration:
+                return
+            yield chunk.text
+    except Exception:
+        metrics.GEMINI_ERRORS.labels(call=call).inc()
+        raise
+    finally:
+        slot.exit()
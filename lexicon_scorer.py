@@ -0,0 +1,82 @@
+import math
+import re
+
+from storage_backend import SCORE_KEYS
+
+# Local stand-in for the Gemini analysis prompt. Far cruder than the model, so it is only
+# used when the Gemini budget cannot keep up (see ANALYSIS_LOCAL_SCORER in bot.py).
+# Plain Python: one tokenization pass and set lookups per message, no extra dependencies.
+
+_LEXICON = {
+    "agitation": {
+        "angry", "mad", "furious", "hate", "hated", "hates", "rage", "pissed", "annoyed", "annoying",
+        "stupid", "idiot", "idiots", "wtf", "damn", "hell", "shut", "sick", "tired", "worst", "scream",
+        "kill", "die", "awful", "terrible", "disgusting", "ugh", "unbelievable", "ridiculous", "crap",
+        "fuck", "fucking", "fucked", "shit", "bullshit", "screw",
+    },
+    "dissent": {
+        "no", "not", "never", "disagree", "wrong", "unfair", "against", "refuse", "won't", "wont",
+        "don't", "dont", "shouldn't", "why", "rules", "mods", "mod", "admin", "admins", "ban", "banned",
+        "censorship", "protest", "complain", "nonsense", "bs", "rigged", "abuse", "power", "tyranny",
+    },
+    "compliance": {
+        "yes", "ok", "okay", "sure", "agree", "agreed", "fine", "alright", "understood", "right",
+        "thanks", "thank", "sorry", "please", "will", "follow", "accept", "true", "exactly", "yeah",
+        "yep", "absolutely", "correct", "noted", "respect", "rule", "allowed", "permission", "agreeable",
+    },
+    "positive": {
+        "good", "great", "love", "loved", "awesome", "nice", "cool", "amazing", "happy", "glad", "fun",
+        "best", "beautiful", "excellent", "perfect", "lol", "lmao", "haha", "thanks", "wonderful",
+        "enjoy", "enjoyed", "congrats", "welcome", "cute", "favorite", "win", "won", "yay", "fantastic",
+    },
+    "negative": {
+        "bad", "sad", "hate", "awful", "terrible", "worst", "sucks", "boring", "ugly", "annoying", "angry",
+        "cry", "lost", "lose", "fail", "failed", "broken", "pain", "hurt", "depressed", "lonely", "sorry",
+        "disgusting", "horrible", "upset", "miserable", "cringe", "trash", "garbage", "dead",
+    },
+}
+
+_VOCABULARY = frozenset().union(*_LEXICON.values())
+_WORD = re.compile(r"[a-z']+")
+
+
+def _saturate(hits: float, scale: float = 1.0) -> float:
+    """Maps a non-negative hit count onto 0..1 with diminishing returns."""
+    return 1.0 - math.exp(-hits / scale)
+
+
+def score_message(content: str) -> dict:
+    """Scores one message on the five analysis dimensions, each in 0.0..1.0."""
+    words = _WORD.findall(content.lower())
+    if not words:
+        return {key: 0.0 for key in SCORE_KEYS} | {"positivity": 0.5}
+
+    counts = {name: sum(1 for word in words if word in lexicon) for name, lexicon in _LEXICON.items()}
+    letters = [c for c in content if c.isalpha()]
+    shouting = sum(1 for c in letters if c.isupper()) / len(letters) if len(letters) >= 8 else 0.0
+    exclamations = content.count("!")
+
+    # Rates per word keep long messages from saturating on length alone
+    per_word = 10.0 / max(len(words), 10)
+    long_words = sum(1 for word in words if len(word) >= 7) / len(words)
+    distinct = len(set(words)) / len(words)
+    mean_length = sum(len(word) for word in words) / len(words)
+
+    polar = counts["positive"] + counts["negative"]   # +1 below keeps a single word from pinning the score
+    positivity = 0.5 + 0.5 * (counts["positive"] - counts["negative"]) / (polar + 1)
+
+    scores = {
+        "agitation": _saturate(counts["agitation"] * per_word + shouting * 2 + min(exclamations, 5) * 0.2),
+        "dissent": _saturate(counts["dissent"] * per_word, scale=1.5),
+        "compliance": _saturate(counts["compliance"] * per_word, scale=1.5),
+        "sophistication": (0.4 * min(1.0, long_words / 0.3)
+                           + 0.3 * distinct
+                           + 0.3 * _saturate(len(words), scale=25) * min(1.0, mean_length / 5)),
+        "positivity": positivity,
+    }
+    return {key: round(min(max(scores[key], 0.0), 1.0), 3) for key in SCORE_KEYS}
+
+
+def has_lexicon_hit(content: str) -> bool:
+    """True if any word of the message is in the lexicon; used to keep short but loaded messages."""
+    return any(word in _VOCABULARY for word in _WORD.findall(content.lower()))
@@ -0,0 +1,141 @@
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+
+import lexicon_scorer
+
+# --- CONSTANTS ---
+PREFILTER_MIN_LETTERS = int(os.getenv('PREFILTER_MIN_LETTERS', '6'))          # Letters left after stripping links, emoji and mentions; waived on a lexicon hit or CJK/Thai-style text
+PREFILTER_MIN_WORDS = int(os.getenv('PREFILTER_MIN_WORDS', '2'))              # Words containing at least one letter; each CJK/Thai-style character counts as one
+PREFILTER_MIN_DISTINCT = int(os.getenv('PREFILTER_MIN_DISTINCT', '4'))        # Distinct letters; catches "hahahaha" and key mashing
+PREFILTER_MIN_UNSPACED = int(os.getenv('PREFILTER_MIN_UNSPACED', '3'))        # Distinct characters in CJK/Thai-style text, where one carries about a word
+PREFILTER_REPEAT_WINDOW = float(os.getenv('PREFILTER_REPEAT_WINDOW', '600'))  # Seconds a user's repeated message is ignored for
+PREFILTER_REPEAT_ENTRIES = int(os.getenv('PREFILTER_REPEAT_ENTRIES', '50000'))
+SCORE_CACHE_SIZE = int(os.getenv('SCORE_CACHE_SIZE', '20000'))                # Scored message hashes kept for reuse
+
+# Verdicts returned by MessageFilter.check()
+LOW_INFORMATION = "low_information"
+REPEAT = "repeat"
+
+_NOISE = re.compile(
+    r"https?://\S+"        # Links
+    r"|<a?:\w+:\d+>"       # Custom emoji
+    r"|<[@#][!&]?\d+>"     # User, role and channel mentions
+    r"|:\w+:"              # Emoji shortcodes
+)
+_REPEATED_CHARS = re.compile(r"(.)\1{2,}")
+# Scripts written without spaces between words: Thai, Lao, Myanmar, Khmer, kana and CJK ideographs
+_UNSPACED_SCRIPT = re.compile(r"[\u0e00-\u0eff\u1000-\u109f\u1780-\u17ff\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+
+
+def normalize(content: str) -> str:
+    """Lowercases, strips links/emoji/mentions and squeezes runs so trivial variants hash alike."""
+    text = _NOISE.sub(" ", content.lower())
+    text = _REPEATED_CHARS.sub(r"\1\1", text)
+    return " ".join(text.split())
+
+
+def _digest(normalized: str) -> bytes:
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest()
+
+
+def content_key(content: str) -> bytes:
+    """Score cache key; equal for messages that only differ in case, links, emoji or spacing."""
+    return _digest(normalize(content))
+
+
+def count_words(normalized: str) -> int:
+    """Space-separated words, except that text in scripts without spaces counts one per character."""
+    unspaced = len(_UNSPACED_SCRIPT.findall(normalized))
+    return _spaced_words(normalized) + unspaced
+
+
+def _spaced_words(normalized: str) -> int:
+    return sum(1 for word in _UNSPACED_SCRIPT.sub(" ", normalized).split() if any(c.isalpha() for c in word))
+
+
+def is_low_information(normalized: str) -> bool:
+    """
+    True for text too thin to score: fewer than PREFILTER_MIN_WORDS words, too few distinct
+    letters (laughter, key mashing), or too few letters unless a word is in the scorer's
+    lexicon, so short messages like "shut up" are still analyzed.
+    Text mostly in scripts without spaces is held to PREFILTER_MIN_UNSPACED distinct characters
+    instead, as one character there carries about a word's worth: "我恨你" is a full sentence.
+    """
+    unspaced = len(_UNSPACED_SCRIPT.findall(normalized))
+    if _spaced_words(normalized) + unspaced < PREFILTER_MIN_WORDS:
+        return True
+    letters = [c for c in normalized if c.isalpha()]
+    distinct = len(set(letters))
+    if unspaced * 2 >= len(letters):
+        return distinct < PREFILTER_MIN_UNSPACED  # Still catches "哈哈哈", "ははは" and "好的"
+    if distinct < PREFILTER_MIN_DISTINCT:
+        return True
+    return len(letters) < PREFILTER_MIN_LETTERS and not lexicon_scorer.has_lexicon_hit(normalized)
+
+
+class MessageFilter:
+    """
+    Runs in on_message, before the analysis queue, so it has to stay cheap:
+    one regex pass, one hash and two dict lookups per message.
+
+    check() rejects messages that carry too little text to score and messages a user
+    repeats within PREFILTER_REPEAT_WINDOW. Identical text from different users still
+    passes; the workers score it once and reuse the result through the score cache.
+    """
+    def __init__(self, repeat_window: float = PREFILTER_REPEAT_WINDOW,
+                 repeat_entries: int = PREFILTER_REPEAT_ENTRIES, score_cache_size: int = SCORE_CACHE_SIZE):
+        self.repeat_window = repeat_window
+        self.repeat_entries = repeat_entries
+        self.score_cache_size = score_cache_size
+        self._recent = OrderedDict()      # (user_id, key) -> expiry, oldest first
+        self._scores = OrderedDict()      # key -> scores, LRU
+        self.passed = 0
+        self.rejected = {LOW_INFORMATION: 0, REPEAT: 0}
+        self.score_cache_hits = 0
+
+    def check(self, user_id: int, content: str) -> str | None:
+        """Returns None if the message should be analyzed, otherwise the reason it should not."""
+        normalized = normalize(content)
+        if is_low_information(normalized):
+            self.rejected[LOW_INFORMATION] += 1
+            return LOW_INFORMATION
+
+        now = time.monotonic()
+        key = (user_id, _digest(normalized))
+        expires = self._recent.get(key)
+        if expires is not None and expires > now:
+            self.rejected[REPEAT] += 1
+            return REPEAT
+
+        self._recent[key] = now + self.repeat_window
+        self._recent.move_to_end(key)
+        while self._recent and (len(self._recent) > self.repeat_entries or next(iter(self._recent.values())) <= now):
+            self._recent.popitem(last=False)
+        self.passed += 1
+        return None
+
+    # --- SCORE CACHE ---
+    def cached_scores(self, key: bytes) -> dict | None:
+        scores = self._scores.get(key)
+        if scores is not None:
+            self._scores.move_to_end(key)
+            self.score_cache_hits += 1
+        return scores
+
+    def store_scores(self, key: bytes, scores: dict):
+        self._scores[key] = scores
+        self._scores.move_to_end(key)
+        while len(self._scores) > self.score_cache_size:
+            self._scores.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "passed": self.passed,
+            "low_information": self.rejected[LOW_INFORMATION],
+            "repeat": self.rejected[REPEAT],
+            "score_cache_hits": self.score_cache_hits,
+            "score_cache_entries": len(self._scores),
+        }
@@ -0,0 +1,248 @@
+import bisect
+import os
+import time
+
+# --- CONSTANTS ---
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))   # 0 disables the HTTP endpoint
+
+# Seconds; spans sub-millisecond cache work up to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY = []
+
+
+# --- METRIC TYPES ---
+# Everything is updated from the event loop thread, so no locking is needed.
+# Hot paths only pay for a dict lookup and an addition; values that already live
+# elsewhere (queue depth, drop counters) are read through callbacks at scrape time.
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._function = None
+        REGISTRY.append(self)
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _default(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} needs labels {self.labelnames}")
+        return self.labels()
+
+    def set_function(self, function):
+        """Reports function() at scrape time instead of a stored value."""
+        self._function = function
+
+    def samples(self):
+        """Yields (suffix, labels dict, value)."""
+        if self._function is not None:
+            yield "", {}, float(self._function())
+            return
+        for key, child in self._children.items():
+            labels = dict(zip(self.labelnames, key))
+            for suffix, extra, value in child.samples():
+                yield suffix, {**labels, **extra}, value
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._function = None
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function):
+        """Reports function() for this label combination at scrape time."""
+        self._function = function
+
+    def get(self) -> float:
+        return float(self._function()) if self._function is not None else self.value
+
+    def samples(self):
+        yield "", {}, self.get()
+
+
+class _ScalarMetric(_Metric):
+    def _new_child(self):
+        return _Value()
+
+    def get(self, **labels) -> float:
+        """Current value, for in-process readers such as /stats."""
+        if self._function is not None:
+            return float(self._function())
+        return self.labels(**labels).get()
+
+
+class Counter(_ScalarMetric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+
+class Gauge(_ScalarMetric):
+    type = "gauge"
+
+    def set(self, value: float):
+        self._default().set(value)
+
+
+class _Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+class _HistogramValue:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def time(self):
+        """Context manager that observes the elapsed wall time of its block."""
+        return _Timer(self)
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile by linear interpolation inside the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+    def samples(self):
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            cumulative += bucket_count
+            yield "_bucket", {"le": repr(bound)}, cumulative
+        yield "_bucket", {"le": "+Inf"}, self.count
+        yield "_sum", {}, self.sum
+        yield "_count", {}, self.count
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, seconds: float):
+        self._default().observe(seconds)
+
+    def time(self):
+        return self._default().time()
+
+    def children(self):
+        """(labels dict, value) for every label combination seen so far."""
+        return [(dict(zip(self.labelnames, key)), child) for key, child in self._children.items()]
+
+
+# --- BOT METRICS ---
+GEMINI_SECONDS = Histogram("sai_gemini_request_seconds", "Gemini call latency.", ("call",))
+GEMINI_ERRORS = Counter("sai_gemini_errors_total", "Gemini calls that raised.", ("call",))
+GEMINI_RETRIES = Counter("sai_gemini_retries_total", "Gemini calls retried after a rate limit, server error or timeout.", ("call",))
+GEMINI_SLOT_WAIT_SECONDS = Histogram("sai_gemini_slot_wait_seconds", "Time spent waiting for a Gemini concurrency slot.", ("lane",))
+GEMINI_WAITING = Gauge("sai_gemini_waiting", "Calls waiting for a Gemini concurrency slot.", ("model",))
+GEMINI_CIRCUIT_OPEN = Gauge("sai_gemini_circuit_open", "1 while the model's circuit breaker rejects calls.", ("model",))
+STORAGE_SECONDS = Histogram("sai_storage_request_seconds", "Storage backend call latency.", ("op",))
+STORAGE_ERRORS = Counter("sai_storage_errors_total", "Storage backend calls that raised.", ("op",))
+ASK_FIRST_CHUNK_SECONDS = Histogram("sai_ask_first_chunk_seconds", "Time from the /ask Gemini request to the first streamed text.")
+ASK_STREAM_SECONDS = Histogram("sai_ask_stream_seconds", "Time from the /ask Gemini request to the end of the stream.")
+ASK_CACHE_HITS = Counter("sai_ask_cache_hits_total", "/ask questions answered from the answer cache.")
+ASK_SHARED = Counter("sai_ask_shared_total", "/ask questions that waited on an identical question already being answered.")
+PROFILE_RENDER_SECONDS = Histogram("sai_profile_render_seconds", "Profile render pool job latency, including pool wait.", ("stage",))
+ANALYSIS_PARSE_FAILURES = Counter("sai_analysis_parse_failures_total", "Analysis batches whose response was not valid JSON.")
+ANALYSIS_MALFORMED_ITEMS = Counter("sai_analysis_malformed_items_total", "Analysis results missing or rejected by validation.")
+ANALYSIS_QUEUE_DEPTH = Gauge("sai_analysis_queue_depth", "Messages waiting for analysis.")
+ANALYSIS_DROPPED = Counter("sai_analysis_dropped_total", "Messages dropped by the analysis queue overflow policy.")
+ANALYSIS_PROCESSED = Counter("sai_analysis_processed_total", "Messages taken off the analysis queue and handled.")
+ANALYSIS_RETRIED = Counter("sai_analysis_retried_total", "Messages requeued after a failed analysis.")
+ANALYSIS_SPILLED = Gauge("sai_analysis_queue_spilled", "Queued messages currently held on disk rather than in memory.")
+ANALYSIS_PREFILTERED = Counter("sai_analysis_prefiltered_total", "Messages skipped before the analysis queue.", ("reason",))
+ANALYSIS_LOCAL_SCORED = Counter("sai_analysis_local_scored_total", "Messages scored by the local lexicon scorer instead of Gemini.")
+ANALYSIS_SCORE_CACHE_HITS = Counter("sai_analysis_score_cache_hits_total", "Messages whose scores were reused from an identical message.")
+ANALYSIS_UNCOMMITTED_ACKS = Counter("sai_analysis_uncommitted_acks_total", "Stored analyses acked after their commit kept failing; lost if the process dies before the next commit.")
+MESSAGE_COUNTS_PENDING = Gauge("sai_message_counts_pending", "Message count increments waiting in the write-behind buffer.")
+USER_CACHE_HITS = Counter("sai_user_cache_hits_total", "User document cache hits.")
+USER_CACHE_MISSES = Counter("sai_user_cache_misses_total", "User document cache misses.")
+
+
+# --- EXPOSITION ---
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def render_prometheus() -> str:
+    """Renders every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for suffix, labels, value in metric.samples():
+            lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {float(value)!r}")
+    return "\n".join(lines) + "\n"
+
+
+async def start_http_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """Serves /metrics on a local port. Returns the aiohttp runner, or None when disabled."""
+    if not port:
+        return None
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return runner
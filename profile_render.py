@@ -0,0 +1,131 @@
+from collections import OrderedDict
+from io import BytesIO
+
+# PIL is imported inside the functions that draw, so importing this module (for RenderCache)
+# stays cheap and PIL is only loaded once the first card is rendered.
+
+# --- CARD LAYOUT ---
+CARD_SIZE = (600, 300)
+AVATAR_SIZE = (128, 128)
+BG_COLOR = (35, 39, 42)        # Discord dark
+HEADER_COLOR = (220, 50, 50)   # Dark red
+
+
+# --- STATIC TEMPLATE ---
+class ProfileTemplate:
+    """
+    Everything on the card that does not depend on the user.
+    Built once; each render starts from a copy of `base`.
+    """
+    def __init__(self):
+        from PIL import Image, ImageDraw, ImageFont
+        try:
+            self.title_font = ImageFont.load_default(size=24)
+            self.main_font = ImageFont.load_default(size=16)
+        except (IOError, TypeError):
+            print("Default font not found, using basic PIL font.")
+            self.title_font = ImageFont.load_default()
+            self.main_font = ImageFont.load_default()
+
+        # Background, header and the fixed labels
+        self.base = Image.new("RGBA", CARD_SIZE, BG_COLOR)
+        header = Image.new("RGBA", (CARD_SIZE[0], 50), HEADER_COLOR)
+        self.base.paste(header, (0, 0))
+        draw = ImageDraw.Draw(self.base)
+        draw.text((10, 10), "SPECIMEN FILE", fill=(255, 255, 255), font=self.title_font)
+        draw.text((30, 230), "Designation:", fill=(220, 50, 50), font=self.title_font)
+
+        # Circular avatar mask
+        self.avatar_mask = Image.new("L", AVATAR_SIZE, 0)
+        ImageDraw.Draw(self.avatar_mask).ellipse((0, 0, *AVATAR_SIZE), fill=255)
+
+        # Shown when the avatar cannot be fetched
+        self.placeholder_avatar = Image.new("RGBA", AVATAR_SIZE)
+        ImageDraw.Draw(self.placeholder_avatar).ellipse((0, 0, *AVATAR_SIZE), fill=(54, 57, 63))
+
+
+_TEMPLATE = None
+
+def load_template() -> ProfileTemplate:
+    """Returns this process's template, building it on first use (also used as a pool initializer)."""
+    global _TEMPLATE
+    if _TEMPLATE is None:
+        _TEMPLATE = ProfileTemplate()
+    return _TEMPLATE
+
+
+# --- RENDERER ---
+def prepare_avatar(avatar_bytes: bytes) -> bytes | None:
+    """
+    (Blocking, CPU-bound)
+    Decodes a downloaded avatar and resizes it to AVATAR_SIZE.
+    Returns raw RGBA bytes, the form stored in the avatar cache, or None if it cannot be decoded.
+    """
+    from PIL import Image
+    try:
+        return Image.open(BytesIO(avatar_bytes)).convert("RGBA").resize(AVATAR_SIZE).tobytes()
+    except Exception as e:
+        print(f"Avatar decode error: {e}")
+        return None
+
+def render_profile_card(avatar_rgba: bytes | None, display_name: str, join_date: str, msg_count: int, designation: str) -> bytes:
+    """
+    (Blocking, CPU-bound)
+    Pure function of bytes and primitives so it can run in a thread or process pool.
+    `avatar_rgba` is the output of prepare_avatar; None draws the placeholder.
+    """
+    from PIL import Image, ImageDraw
+    template = load_template()
+
+    if avatar_rgba:
+        avatar_image = Image.frombytes("RGBA", AVATAR_SIZE, avatar_rgba)
+    else:
+        avatar_image = template.placeholder_avatar
+
+    card = template.base.copy()
+    card.paste(avatar_image, (30, 80), template.avatar_mask)
+
+    draw = ImageDraw.Draw(card)
+    draw.text((180, 90), display_name, fill=(255, 255, 255), font=template.title_font)
+    draw.text((180, 130), f"Joined Server: {join_date}", fill=(180, 180, 180), font=template.main_font)
+    draw.text((180, 150), f"Transmissions: {msg_count}", fill=(180, 180, 180), font=template.main_font)
+    draw.text((30, 250), f'"{designation}"', fill=(220, 220, 220), font=template.main_font)
+
+    buffer = BytesIO()
+    card.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+# --- RENDERED CARD CACHE ---
+class RenderCache:
+    """LRU cache of encoded PNG cards, evicted by total size in bytes rather than entry count."""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key) -> bytes | None:
+        png_bytes = self._entries.get(key)
+        if png_bytes is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return png_bytes
+
+    def put(self, key, png_bytes: bytes):
+        if len(png_bytes) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.total_bytes -= len(old)
+        self._entries[key] = png_bytes
+        self.total_bytes += len(png_bytes)
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= len(evicted)
+
+    def __len__(self):
+        return len(self._entries)
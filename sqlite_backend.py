@@ -0,0 +1,239 @@
+import json
+import sqlite3
+import threading
+import time
+
+from storage_backend import SCORE_KEYS, StorageBackend
+
+_SUM_COLUMNS = [f"{key}_sum" for key in SCORE_KEYS]
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Embedded single-node storage in one SQLite file, in WAL mode.
+
+    Writes are not committed one by one: a commit happens once `commit_every` writes
+    are outstanding or `commit_interval` seconds have passed, and on commit()/close().
+    Reads share the connection, so they always see uncommitted writes. A crash can
+    lose at most the writes since the last commit.
+    """
+    name = "sqlite"
+
+    def __init__(self, path: str, commit_interval: float = 1.0, commit_every: int = 500):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.commit_every = commit_every
+        self._lock = threading.Lock()   # asyncio.to_thread calls arrive from several threads
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level="DEFERRED")
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        sum_columns = ", ".join(f"{column} REAL NOT NULL DEFAULT 0" for column in _SUM_COLUMNS)
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id TEXT PRIMARY KEY,
+                server_id TEXT,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                user_mmotto TEXT,
+                analysis_count INTEGER NOT NULL DEFAULT 0,
+                {sum_columns},
+                last_analyzed_ts REAL,
+                designation_cache TEXT
+            );
+            CREATE TABLE IF NOT EXISTS channel_audits (
+                channel_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS members (
+                guild_id TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                analysis_count INTEGER NOT NULL DEFAULT 0,
+                {sum_columns},
+                PRIMARY KEY (guild_id, user_id)
+            );
+            CREATE TABLE IF NOT EXISTS guild_totals (
+                guild_id TEXT PRIMARY KEY,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                analysis_count INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS leaderboards (
+                guild_id TEXT PRIMARY KEY,
+                boards TEXT NOT NULL
+            );
+        """)
+        self.conn.commit()
+
+    def _after_write(self, writes: int = 1):
+        """(Lock held) Commits once enough writes or time have accumulated."""
+        self._uncommitted += writes
+        if self._uncommitted >= self.commit_every or time.monotonic() - self._last_commit >= self.commit_interval:
+            self._commit_locked()
+
+    def _commit_locked(self):
+        if self._uncommitted:
+            self.conn.commit()
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+
+    def increment_message_counts(self, pending: dict):
+        rows = [(user_id, server_id, increment) for (user_id, server_id), increment in pending.items()]
+        guild_totals = {}
+        for (_, server_id), increment in pending.items():
+            guild_totals[server_id] = guild_totals.get(server_id, 0) + increment
+        with self._lock:
+            # All rows apply or none do, so a retry of `pending` cannot double count.
+            # The savepoint must nest in an open transaction: as the outermost one its RELEASE would commit.
+            if not self.conn.in_transaction:
+                self.conn.execute("BEGIN")
+            self.conn.execute("SAVEPOINT message_counts")
+            try:
+                self.conn.executemany("""
+                    INSERT INTO users (user_id, server_id, message_count) VALUES (?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        server_id = excluded.server_id,
+                        message_count = message_count + excluded.message_count
+                """, rows)
+                self.conn.executemany("""
+                    INSERT INTO members (user_id, guild_id, message_count) VALUES (?, ?, ?)
+                    ON CONFLICT(guild_id, user_id) DO UPDATE SET message_count = message_count + excluded.message_count
+                """, rows)
+                self.conn.executemany("""
+                    INSERT INTO guild_totals (guild_id, message_count) VALUES (?, ?)
+                    ON CONFLICT(guild_id) DO UPDATE SET message_count = message_count + excluded.message_count
+                """, guild_totals.items())
+            except Exception:
+                self.conn.execute("ROLLBACK TO message_counts")
+                raise
+            finally:
+                self.conn.execute("RELEASE message_counts")
+            self._after_write(len(rows))
+        pending.clear()
+
+    def get_user_profile(self, user_id):
+        with self._lock:
+            row = self.conn.execute("SELECT * FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+        if row is None:
+            return None
+
+        profile = {"message_count": row["message_count"], "analysis_count": row["analysis_count"]}
+        for field in ("server_id", "user_mmotto", "last_analyzed_ts"):
+            if row[field] is not None:
+                profile[field] = row[field]
+        if row["analysis_count"]:
+            profile["analysis_sums"] = {key: row[f"{key}_sum"] for key in SCORE_KEYS}
+        if row["designation_cache"]:
+            profile["designation_cache"] = json.loads(row["designation_cache"])
+        return profile
+
+    def set_user_motto(self, user_id, server_id, motto):
+        with self._lock:
+            self.conn.execute("""
+                INSERT INTO users (user_id, server_id, user_mmotto) VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    server_id = excluded.server_id,
+                    user_mmotto = excluded.user_mmotto
+            """, (str(user_id), str(server_id), motto))
+            self._after_write()
+
+    def set_user_designation(self, user_id, text, scores_key, total_analyzed):
+        designation = json.dumps({"text": text, "scores_key": scores_key, "total_analyzed": total_analyzed})
+        with self._lock:
+            self.conn.execute("""
+                INSERT INTO users (user_id, designation_cache) VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET designation_cache = excluded.designation_cache
+            """, (str(user_id), designation))
+            self._after_write()
+
+    def add_user_analysis(self, user_id, sums, count, guild_id=None):
+        columns = ", ".join(_SUM_COLUMNS)
+        placeholders = ", ".join("?" for _ in _SUM_COLUMNS)
+        updates = ", ".join(f"{column} = {column} + excluded.{column}" for column in _SUM_COLUMNS)
+        sum_values = [sums.get(key, 0) for key in SCORE_KEYS]
+        with self._lock:
+            self.conn.execute(f"""
+                INSERT INTO users (user_id, analysis_count, last_analyzed_ts, {columns})
+                VALUES (?, ?, ?, {placeholders})
+                ON CONFLICT(user_id) DO UPDATE SET
+                    analysis_count = analysis_count + excluded.analysis_count,
+                    last_analyzed_ts = excluded.last_analyzed_ts,
+                    {updates}
+            """, (str(user_id), count, time.time(), *sum_values))
+            writes = 1
+            if guild_id is not None:
+                self.conn.execute(f"""
+                    INSERT INTO members (guild_id, user_id, analysis_count, {columns})
+                    VALUES (?, ?, ?, {placeholders})
+                    ON CONFLICT(guild_id, user_id) DO UPDATE SET
+                        analysis_count = analysis_count + excluded.analysis_count,
+                        {updates}
+                """, (str(guild_id), str(user_id), count, *sum_values))
+                self.conn.execute("""
+                    INSERT INTO guild_totals (guild_id, analysis_count) VALUES (?, ?)
+                    ON CONFLICT(guild_id) DO UPDATE SET analysis_count = analysis_count + excluded.analysis_count
+                """, (str(guild_id), count))
+                writes += 2
+            self._after_write(writes)
+
+    def get_member_stats(self, guild_id, user_ids):
+        user_ids = [str(user_id) for user_id in user_ids]
+        stats = {}
+        with self._lock:
+            # Chunked to stay under SQLite's bound parameter limit
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT * FROM members WHERE guild_id = ? AND user_id IN ({', '.join('?' for _ in chunk)})",
+                    (str(guild_id), *chunk)
+                ).fetchall()
+                for row in rows:
+                    stats[row["user_id"]] = {
+                        "message_count": row["message_count"],
+                        "analysis_count": row["analysis_count"],
+                        "analysis_sums": {key: row[f"{key}_sum"] for key in SCORE_KEYS},
+                    }
+        return stats
+
+    def get_guild_totals(self, guild_id):
+        with self._lock:
+            row = self.conn.execute("SELECT message_count, analysis_count FROM guild_totals WHERE guild_id = ?",
+                                    (str(guild_id),)).fetchone()
+        return dict(row) if row else {"message_count": 0, "analysis_count": 0}
+
+    def get_leaderboards(self, guild_id):
+        with self._lock:
+            row = self.conn.execute("SELECT boards FROM leaderboards WHERE guild_id = ?", (str(guild_id),)).fetchone()
+        return json.loads(row["boards"]) if row else None
+
+    def set_leaderboards(self, guild_id, boards):
+        with self._lock:
+            self.conn.execute("""
+                INSERT INTO leaderboards (guild_id, boards) VALUES (?, ?)
+                ON CONFLICT(guild_id) DO UPDATE SET boards = excluded.boards
+            """, (str(guild_id), json.dumps(boards)))
+            self._after_write()
+
+    def get_audit_state(self, channel_id):
+        with self._lock:
+            row = self.conn.execute("SELECT state FROM channel_audits WHERE channel_id = ?", (str(channel_id),)).fetchone()
+        return json.loads(row["state"]) if row else None
+
+    def set_audit_state(self, channel_id, state):
+        with self._lock:
+            self.conn.execute("""
+                INSERT INTO channel_audits (channel_id, state) VALUES (?, ?)
+                ON CONFLICT(channel_id) DO UPDATE SET state = excluded.state
+            """, (str(channel_id), json.dumps(state)))
+            self._after_write()
+
+    def commit(self):
+        with self._lock:
+            self._commit_locked()
+
+    def close(self):
+        with self._lock:
+            self._commit_locked()
+            self.conn.close()
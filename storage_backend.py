@@ -0,0 +1,72 @@
+SCORE_KEYS = ("agitation", "dissent", "compliance", "sophistication", "positivity")
+
+
+class StorageBackend:
+    """
+    Blocking storage operations behind database_utils.
+    database_utils runs every method through asyncio.to_thread and keeps the
+    write-behind buffer and user cache itself, so backends only move data.
+
+    User documents are returned as dicts with the stored counters:
+    'message_count', 'server_id', 'user_mmotto', 'analysis_sums' ({dimension: sum}),
+    'analysis_count', 'last_analyzed_ts' and 'designation_cache'.
+    Averages are computed by database_utils on read.
+
+    Each guild also keeps member records ('message_count', 'analysis_sums',
+    'analysis_count' for that guild only), running guild totals and one stored
+    leaderboards document that database_utils maintains incrementally.
+    """
+    name = "base"
+
+    def increment_message_counts(self, pending: dict):
+        """
+        Applies {(user_id, server_id): increment} to the user documents, the guild's
+        member records and the guild totals. Committed entries must be removed
+        from `pending` so that, on failure, only the remainder is retried.
+        """
+        raise NotImplementedError
+
+    def get_user_profile(self, user_id) -> dict | None:
+        raise NotImplementedError
+
+    def set_user_motto(self, user_id, server_id, motto):
+        raise NotImplementedError
+
+    def set_user_designation(self, user_id, text: str, scores_key: list, total_analyzed: int):
+        raise NotImplementedError
+
+    def add_user_analysis(self, user_id, sums: dict, count: int, guild_id=None):
+        """
+        Adds per-dimension score sums and the number of scored messages,
+        also to the member record and totals of `guild_id` when given.
+        """
+        raise NotImplementedError
+
+    # --- GUILDS ---
+    def get_member_stats(self, guild_id, user_ids: list) -> dict:
+        """Returns {user_id: member record} for the members that exist, in one round trip."""
+        raise NotImplementedError
+
+    def get_guild_totals(self, guild_id) -> dict:
+        """Returns {'message_count': int, 'analysis_count': int} for the guild."""
+        raise NotImplementedError
+
+    def get_leaderboards(self, guild_id) -> dict | None:
+        """Returns the stored {metric: [[user_id, value], ...]} document, if any."""
+        raise NotImplementedError
+
+    def set_leaderboards(self, guild_id, boards: dict):
+        raise NotImplementedError
+
+    def get_audit_state(self, channel_id) -> dict | None:
+        raise NotImplementedError
+
+    def set_audit_state(self, channel_id, state: dict):
+        raise NotImplementedError
+
+    def commit(self):
+        """Makes buffered writes durable. Backends that write through can ignore this."""
+
+    def close(self):
+        """Releases connections after a final commit."""
+        self.commit()
@@ -0,0 +1,185 @@
+import asyncio
+
+import pytest
+
+import analysis_queue
+from analysis_queue import AnalysisQueue, SpillingAnalysisQueue
+
+
+def drain(queue):
+    """Takes everything queued without waiting, marking each item done."""
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+        queue.task_done()
+    return items
+
+
+def log_rows(queue):
+    queue.commit()
+    return queue.conn.execute("SELECT COUNT(*) FROM analysis_log").fetchone()[0]
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / "analysis_queue.db")
+
+
+# --- AnalysisQueue ---
+def test_drop_oldest_evicts_head():
+    queue = AnalysisQueue(maxsize=3, policy=analysis_queue.DROP_OLDEST)
+    for i in range(5):
+        queue.put_nowait((i, f"m{i}", 1))
+    assert [item[1] for item in drain(queue)] == ["m2", "m3", "m4"]
+    assert queue.dropped == 2
+
+
+def test_sample_per_user_drops_heaviest_sender():
+    queue = AnalysisQueue(maxsize=4, policy=analysis_queue.SAMPLE_PER_USER)
+    for i in range(3):
+        queue.put_nowait((1, f"spam{i}", 1))
+    queue.put_nowait((2, "a", 1))
+    assert queue.put_nowait((1, "spam3", 1)) == (1, "spam3", 1)   # Sender already holds the most
+    assert queue.put_nowait((3, "b", 1)) == (1, "spam0", 1)       # Room is made from the heaviest sender
+    assert sorted(item[0] for item in drain(queue)) == [1, 1, 2, 3]
+
+
+def test_nack_requeues_until_max_attempts():
+    async def scenario():
+        queue = AnalysisQueue(maxsize=10, max_attempts=2)
+        queue.put_nowait((1, "hello", 1))
+        item = await queue.get()
+        queue.nack([item])
+        queue.task_done()
+        retried = await queue.get()
+        assert retried == (1, "hello", 1, 1)
+        queue.nack([retried])
+        queue.task_done()
+        assert queue.empty()
+        assert (queue.retried, queue.dropped) == (1, 1)
+        await asyncio.wait_for(queue.join(), 1)
+
+    asyncio.run(scenario())
+
+
+# --- SpillingAnalysisQueue ---
+def test_spills_past_memory_size_in_fifo_order(log_path):
+    queue = SpillingAnalysisQueue(log_path, maxsize=100, memory_size=5, spill_batch=3)
+    for i in range(20):
+        queue.put_nowait((i % 3, f"m{i}", 1))
+    assert queue.stats()["in_memory"] == 5
+    assert queue.stats()["spilled"] == 15
+    assert [item[1] for item in drain(queue)] == [f"m{i}" for i in range(20)]
+    queue.close()
+
+
+def test_ack_deletes_spilled_rows(log_path):
+    queue = SpillingAnalysisQueue(log_path, maxsize=100, memory_size=2)
+    for i in range(6):
+        queue.put_nowait((1, f"m{i}", 1))
+    items = drain(queue)
+    assert log_rows(queue) == 4
+    queue.ack(items)
+    assert log_rows(queue) == 0
+    queue.close()
+
+
+def test_nack_keeps_one_row_per_retried_item(log_path):
+    queue = SpillingAnalysisQueue(log_path, maxsize=100, memory_size=1, max_attempts=3)
+    for i in range(3):
+        queue.put_nowait((1, f"m{i}", 1))
+    items = drain(queue)
+    queue.nack(items)
+    assert queue.qsize() == 3
+    # The original rows are released; the first requeued copy fits in memory, the rest spill
+    assert log_rows(queue) == 2
+    assert all(item[3] == 1 for item in drain(queue))
+    queue.close()
+
+
+def test_close_then_restore_replays_unacked_items(log_path):
+    async def first_run():
+        queue = SpillingAnalysisQueue(log_path, maxsize=100, memory_size=4)
+        for i in range(10):
+            queue.put_nowait((i, f"m{i}", 7))
+        done = [await queue.get() for _ in range(3)]
+        in_flight = await queue.get()
+        queue.ack(done)
+        for _ in range(4):
+            queue.task_done()
+        queue.close()
+        return in_flight
+
+    in_flight = asyncio.run(first_run())
+
+    async def second_run():
+        queue = SpillingAnalysisQueue(log_path, maxsize=100, memory_size=4)
+        assert queue.restore() == 7
+        assert queue.qsize() == 7
+        contents = []
+        while not queue.empty():
+            item = await queue.get()
+            contents.append(item[1])
+            assert item[2] == 7
+            queue.ack([item])
+            queue.task_done()
+        await asyncio.wait_for(queue.join(), 1)   # Restored items are tracked like any other
+        assert log_rows(queue) == 0
+        queue.close()
+        return contents
+
+    contents = asyncio.run(second_run())
+    assert sorted(contents) == sorted([in_flight[1]] + [f"m{i}" for i in range(4, 10)])
+
+
+def test_restore_wakes_waiting_getter(log_path):
+    queue = SpillingAnalysisQueue(log_path, maxsize=100, memory_size=4)
+    queue.put_nowait((1, "left over", 1))
+    queue.close()
+
+    async def scenario():
+        restored = SpillingAnalysisQueue(log_path, maxsize=100, memory_size=4)
+        getter = asyncio.create_task(restored.get())
+        await asyncio.sleep(0)
+        assert restored.restore() == 1
+        item = await asyncio.wait_for(getter, 1)
+        assert item[1] == "left over"
+        restored.ack([item])
+        restored.task_done()
+        restored.close()
+
+    asyncio.run(scenario())
+
+
+def test_restore_applies_overflow_policy(log_path):
+    queue = SpillingAnalysisQueue(log_path, maxsize=100, memory_size=4)
+    for i in range(12):
+        queue.put_nowait((i, f"m{i}", 1))
+    queue.close()
+
+    smaller = SpillingAnalysisQueue(log_path, maxsize=5, memory_size=4, policy=analysis_queue.DROP_OLDEST)
+    assert smaller.restore() == 5
+    assert smaller.dropped == 7
+    assert log_rows(smaller) == 5
+    assert [item[1] for item in drain(smaller)] == [f"m{i}" for i in range(7, 12)]
+    smaller.close()
+
+
+def test_restore_on_empty_log(log_path):
+    queue = SpillingAnalysisQueue(log_path, maxsize=10, memory_size=2)
+    assert queue.restore() == 0
+    assert queue.empty()
+    queue.close()
+    queue.close()   # Idempotent
+
+
+def test_spilled_items_are_inserted_in_batches(log_path):
+    queue = SpillingAnalysisQueue(log_path, maxsize=100, memory_size=1, spill_batch=3, commit_interval=60)
+    for i in range(3):
+        queue.put_nowait((1, f"m{i}", 1))
+    count = "SELECT COUNT(*) FROM analysis_log"
+    assert queue.conn.execute(count).fetchone()[0] == 0   # Two spilled, still buffered
+    queue.put_nowait((1, "m3", 1))
+    assert queue.conn.execute(count).fetchone()[0] == 3   # One executemany for the batch
+    assert [item[1] for item in drain(queue)] == ["m0", "m1", "m2", "m3"]
+    queue.close()
@@ -0,0 +1,212 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("discord")
+
+import analysis_queue
+import bot
+import database_utils
+import gemini_client
+
+
+class ApiError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+class Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """Raises `error` on every call if given, otherwise scores each message in the prompt 0.5."""
+    def __init__(self, error=None, text=None):
+        self.error = error
+        self.text = text
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, stream=False):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        if self.text is not None:
+            return Response(self.text)
+        count = sum(1 for line in prompt.splitlines() if line.split(":")[0].isdigit())
+        return Response(json.dumps([{"index": i} | {key: 0.5 for key in database_utils.SCORE_KEYS} for i in range(count)]))
+
+
+@pytest.fixture
+def worker_bot(monkeypatch):
+    """A MyBot whose analysis worker handles exactly one batch, with no Discord connection."""
+    monkeypatch.setattr(gemini_client, "_models", {})
+    monkeypatch.setattr(gemini_client, "_gates", {})
+    monkeypatch.setattr(gemini_client, "GEMINI_BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(gemini_client, "GEMINI_BACKOFF_MAX", 0.001)
+    monkeypatch.setattr(bot, "ANALYSIS_QUEUE_SPILL_PATH", "")
+    monkeypatch.setattr(bot, "ANALYSIS_BATCH_WINDOW", 0)
+    monkeypatch.setattr(bot, "ANALYSIS_LOCAL_SCORER", "off")
+
+    stored = []
+
+    async def update_user_analysis(user_id, scores, guild_id=None):
+        stored.append((user_id, len(scores)))
+
+    async def commit():
+        pass
+
+    monkeypatch.setattr(database_utils, "update_user_analysis", update_user_analysis)
+    monkeypatch.setattr(database_utils, "commit", commit)
+
+    async def wait_until_ready():
+        pass
+
+    instance = bot.MyBot()
+    instance.stored = stored
+    instance.wait_until_ready = wait_until_ready
+    instance.is_closed = lambda: instance.analysis_queue.processed > 0
+    instance.analysis_queue.put_nowait((1, "the mods are being unfair again", 10))
+    return instance
+
+
+def run_one_batch(instance):
+    asyncio.run(asyncio.wait_for(instance.analysis_worker(), 5))
+
+
+def requeued(instance):
+    return [instance.analysis_queue.get_nowait() for _ in range(instance.analysis_queue.qsize())]
+
+
+# --- _parse_batch_scores ---
+def scores(index=None, **overrides):
+    item = {key: 0.5 for key in database_utils.SCORE_KEYS} | overrides
+    return item if index is None else {"index": index} | item
+
+
+def parse(items, batch_len):
+    return bot.MyBot._parse_batch_scores(json.dumps(items), batch_len)
+
+
+def test_parse_accepts_fenced_json():
+    text = "```json\n" + json.dumps([scores(0), scores(1)]) + "\n```"
+    assert set(bot.MyBot._parse_batch_scores(text, 2)) == {0, 1}
+
+
+def test_parse_wraps_a_single_object():
+    assert parse(scores(0), 1) == {0: scores()}
+    assert parse(scores(), 1) == {0: scores()}   # A lone result may leave out its index
+    assert parse(scores(), 2) == {}              # ...but not when there is more than one message
+
+
+def test_parse_rejects_non_array_output():
+    with pytest.raises(json.JSONDecodeError):
+        parse("just text", 1)
+    with pytest.raises(json.JSONDecodeError):
+        bot.MyBot._parse_batch_scores("not json at all", 1)
+
+
+def test_parse_skips_bad_indexes():
+    items = [scores(0), scores(0, agitation=0.9), scores(True), scores(-1), scores(3), scores("1"), scores()]
+    assert parse(items, 3) == {0: scores()}   # The first result for an index wins
+
+
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), float("-inf"), "0.5", None, True])
+def test_parse_skips_items_with_invalid_scores(value):
+    assert parse([scores(0, agitation=value), scores(1)], 2) == {1: scores()}
+
+
+def test_parse_skips_items_missing_a_score():
+    item = scores(0)
+    del item["dissent"]
+    assert parse([item], 1) == {}
+
+
+def test_parse_clamps_scores():
+    assert parse([scores(0, agitation=1.7, dissent=-0.2, compliance=1)], 1) == {0: scores(agitation=1.0, dissent=0.0, compliance=1.0)}
+
+
+def test_parse_keeps_the_valid_part_of_an_array():
+    items = [scores(2), "oops", None, scores(0, positivity=float("nan")), [0.5], scores(1)]
+    assert parse(items, 3) == {1: scores(), 2: scores()}
+
+
+# --- Analysis worker ---
+def test_open_circuit_is_waited_out_without_a_token(worker_bot):
+    model = FakeModel()
+    gemini_client.register_model(gemini_client.ANALYSIS_MODEL, model)
+    breaker = gemini_client._gate(gemini_client.ANALYSIS_MODEL).breaker
+    breaker.cooldown = 0.05
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+
+    run_one_batch(worker_bot)
+    assert model.calls == 1
+    assert worker_bot.stored == [(1, 1)]
+    assert worker_bot.analysis_limiter.tokens == pytest.approx(bot.GEMINI_ANALYSIS_BURST - 1, abs=0.05)
+    assert worker_bot.analysis_queue.retried == 0
+
+
+def test_retryable_failures_requeue_without_an_attempt(worker_bot, monkeypatch):
+    monkeypatch.setattr(gemini_client, "GEMINI_MAX_ATTEMPTS", 2)
+    model = FakeModel(ApiError(503))
+    gemini_client.register_model(gemini_client.ANALYSIS_MODEL, model)
+
+    run_one_batch(worker_bot)
+    assert model.calls == 2
+    assert worker_bot.analysis_limiter.tokens == pytest.approx(bot.GEMINI_ANALYSIS_BURST - 2, abs=0.05)
+    assert requeued(worker_bot) == [(1, "the mods are being unfair again", 10)]
+    assert worker_bot.analysis_queue.dropped == 0
+
+
+def test_request_never_sent_refunds_its_token(worker_bot):
+    model = FakeModel(ApiError(503))
+    gemini_client.register_model(gemini_client.ANALYSIS_MODEL, model)
+    gemini_client._gate(gemini_client.ANALYSIS_MODEL).breaker.threshold = 1
+
+    run_one_batch(worker_bot)   # The first failure opens the circuit, so the retry is never sent
+    assert model.calls == 1
+    assert worker_bot.analysis_limiter.tokens == pytest.approx(bot.GEMINI_ANALYSIS_BURST - 1, abs=0.05)
+    assert requeued(worker_bot) == [(1, "the mods are being unfair again", 10)]
+
+
+def test_request_errors_use_up_an_attempt(worker_bot):
+    gemini_client.register_model(gemini_client.ANALYSIS_MODEL, FakeModel(ApiError(400)))
+
+    run_one_batch(worker_bot)
+    assert requeued(worker_bot) == [(1, "the mods are being unfair again", 10, 1)]
+
+
+def test_invalid_json_uses_up_an_attempt(worker_bot):
+    gemini_client.register_model(gemini_client.ANALYSIS_MODEL, FakeModel(text="I'd rather not."))
+
+    run_one_batch(worker_bot)
+    assert requeued(worker_bot) == [(1, "the mods are being unfair again", 10, 1)]
+
+
+def test_failed_commit_still_releases_stored_messages(worker_bot, monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "ANALYSIS_COMMIT_ATTEMPTS", 1)
+    commits = []
+
+    async def failing_commit():
+        commits.append(1)
+        raise OSError("disk I/O error")
+
+    monkeypatch.setattr(database_utils, "commit", failing_commit)
+    gemini_client.register_model(gemini_client.ANALYSIS_MODEL, FakeModel())
+    queue = analysis_queue.SpillingAnalysisQueue(str(tmp_path / "queue.db"), maxsize=100, memory_size=1)
+    worker_bot.analysis_queue = queue
+    queue.put_nowait((1, "the mods are being unfair again", 10))
+    queue.put_nowait((2, "these rules make no sense at all", 10))   # Spilled to the log
+
+    run_one_batch(worker_bot)
+    assert commits == [1]
+    assert len(worker_bot.stored) == 2
+    assert queue._in_flight == {} and queue._row_ids == {}
+    queue.close()
+    # Their writes go out with the next commit, so a restart must not replay them
+    restarted = analysis_queue.SpillingAnalysisQueue(str(tmp_path / "queue.db"), maxsize=100, memory_size=1)
+    assert restarted.restore() == 0
+    restarted.close()
@@ -0,0 +1,150 @@
+import asyncio
+import threading
+
+import pytest
+
+import database_utils
+from storage_backend import SCORE_KEYS, StorageBackend
+
+
+class GatedBackend(StorageBackend):
+    """In-memory backend whose reads can be held open to line up races with writes."""
+    def __init__(self):
+        self.users = {}
+        self.reads = 0
+        self.hold_reads = False
+        self.gates = []
+
+    def get_user_profile(self, user_id):
+        self.reads += 1
+        snapshot = dict(self.users.get(str(user_id), {"message_count": 0, "analysis_count": 0}))
+        if self.hold_reads:
+            gate = threading.Event()
+            self.gates.append(gate)
+            gate.wait(5)
+        return snapshot
+
+    def increment_message_counts(self, pending):
+        for (user_id, _), increment in list(pending.items()):
+            user = self.users.setdefault(user_id, {"message_count": 0, "analysis_count": 0})
+            user["message_count"] += increment
+            del pending[(user_id, _)]
+
+    def add_user_analysis(self, user_id, sums, count, guild_id=None):
+        user = self.users.setdefault(str(user_id), {"message_count": 0, "analysis_count": 0})
+        user["analysis_count"] += count
+
+    def set_user_motto(self, user_id, server_id, motto):
+        self.users.setdefault(str(user_id), {"message_count": 0, "analysis_count": 0})["user_mmotto"] = motto
+
+
+@pytest.fixture
+def backend(fresh_database_utils):
+    backend = GatedBackend()
+    database_utils.init_db(backend)
+    return backend
+
+
+async def wait_for_gates(backend, count):
+    while len(backend.gates) < count:
+        await asyncio.sleep(0.001)
+
+
+SCORES = {key: 0.5 for key in SCORE_KEYS}
+
+
+def test_second_read_is_served_from_cache(backend):
+    async def scenario():
+        await database_utils.get_user_profile(1)
+        await database_utils.get_user_profile(1)
+
+    asyncio.run(scenario())
+    assert backend.reads == 1
+
+
+def test_expired_entry_is_read_again(backend, monkeypatch):
+    monkeypatch.setattr(database_utils, "USER_CACHE_TTL", 0)
+
+    async def scenario():
+        await database_utils.get_user_profile(1)
+        await database_utils.get_user_profile(1)
+
+    asyncio.run(scenario())
+    assert backend.reads == 2
+
+
+def test_write_during_read_is_not_cached(backend):
+    async def scenario():
+        backend.hold_reads = True
+        read = asyncio.create_task(database_utils.get_user_profile(1))
+        await wait_for_gates(backend, 1)
+        await database_utils.update_user_analysis(1, SCORES)
+        backend.gates[0].set()
+        assert (await read)["total_analyzed"] == 0   # The read predates the write...
+        backend.hold_reads = False
+        assert (await database_utils.get_user_profile(1))["total_analyzed"] == 1   # ...so it was not cached
+
+    asyncio.run(scenario())
+
+
+def test_overlapping_reads_each_see_the_write(backend):
+    async def scenario():
+        backend.hold_reads = True
+        first = asyncio.create_task(database_utils.get_user_profile(1))
+        second = asyncio.create_task(database_utils.get_user_profile(1))
+        await wait_for_gates(backend, 2)
+        await database_utils.update_user_analysis(1, SCORES)
+        backend.gates[0].set()
+        await first
+        backend.gates[1].set()   # Finishing after the first must not lose track of the write
+        await second
+        assert "1" not in database_utils._user_cache
+        assert database_utils._fetches_in_flight == {}
+
+    asyncio.run(scenario())
+
+
+def test_read_started_after_write_is_cached(backend):
+    async def scenario():
+        await database_utils.update_user_analysis(1, SCORES)
+        assert (await database_utils.get_user_profile(1))["total_analyzed"] == 1
+        assert (await database_utils.get_user_profile(1))["total_analyzed"] == 1
+
+    asyncio.run(scenario())
+    assert backend.reads == 1
+
+
+def test_flush_during_read_is_not_cached(backend):
+    async def scenario():
+        await database_utils.update_message_count(1, 10)
+        backend.hold_reads = True
+        read = asyncio.create_task(database_utils.get_user_profile(1))
+        await wait_for_gates(backend, 1)
+        await database_utils.flush_message_counts()
+        backend.gates[0].set()
+        await read
+        assert "1" not in database_utils._user_cache
+
+    asyncio.run(scenario())
+
+
+def test_buffered_counts_and_writes_update_the_cached_document(backend):
+    async def scenario():
+        await database_utils.get_user_profile(1)
+        await database_utils.update_message_count(1, 10)
+        await database_utils.set_user_motto(1, 10, "obey")
+        profile = await database_utils.get_user_profile(1)
+        assert profile["message_count"] == 1
+        assert profile["user_mmotto"] == "obey"
+
+    asyncio.run(scenario())
+    assert backend.reads == 1
+
+
+def test_returned_documents_are_copies(backend):
+    async def scenario():
+        profile = await database_utils.get_user_profile(1)
+        profile["message_count"] = 999
+        assert (await database_utils.get_user_profile(1))["message_count"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,182 @@
+import asyncio
+
+import pytest
+
+import gemini_client
+from gemini_client import CircuitBreaker, CircuitOpenError, GeminiBusyError, PrioritySemaphore
+
+
+class ApiError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+class FakeModel:
+    """Raises the queued errors in turn, then answers; `hold` keeps calls open until set."""
+    def __init__(self, errors=(), hold=None):
+        self.errors = list(errors)
+        self.hold = hold
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, stream=False):
+        self.calls += 1
+        if self.hold is not None:
+            await self.hold.wait()
+        if self.errors:
+            raise self.errors.pop(0)
+        return f"answer to {prompt}"
+
+
+@pytest.fixture(autouse=True)
+def fresh_client(monkeypatch):
+    monkeypatch.setattr(gemini_client, "_models", {})
+    monkeypatch.setattr(gemini_client, "_gates", {})
+    monkeypatch.setattr(gemini_client, "GEMINI_BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(gemini_client, "GEMINI_BACKOFF_MAX", 0.001)
+
+
+# --- CircuitBreaker ---
+def test_breaker_opens_at_threshold():
+    breaker = CircuitBreaker(threshold=3, cooldown=60)
+    for _ in range(2):
+        breaker.record_failure()
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_breaker_success_resets_failure_count():
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert not breaker.is_open
+
+
+def test_breaker_lets_one_probe_through_after_cooldown():
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+    breaker.record_failure()
+    breaker.before_call()   # Cooldown over: this call is the probe
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()   # Only one probe at a time
+    breaker.record_failure()   # Failed probe reopens
+    assert breaker.opened_at is not None
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.opened_at is None
+    breaker.before_call()
+
+
+def test_abandoned_probe_lets_next_call_probe():
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.abandon_probe()
+    breaker.before_call()
+
+
+# --- PrioritySemaphore ---
+def test_semaphore_serves_lower_priority_value_first_then_fifo():
+    async def scenario():
+        semaphore = PrioritySemaphore(1)
+        await semaphore.acquire(0)
+        order = []
+
+        async def waiter(name, priority):
+            await semaphore.acquire(priority)
+            order.append(name)
+            semaphore.release()
+
+        tasks = [asyncio.create_task(waiter(name, priority))
+                 for name, priority in [("bg1", 1), ("bg2", 1), ("int1", 0), ("int2", 0)]]
+        await asyncio.sleep(0)
+        assert semaphore.waiting() == 4
+        semaphore.release()
+        await asyncio.gather(*tasks)
+        assert order == ["int1", "int2", "bg1", "bg2"]
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def scenario():
+        semaphore = PrioritySemaphore(1)
+        await semaphore.acquire(0)
+        cancelled = asyncio.create_task(semaphore.acquire(0))
+        await asyncio.sleep(0)
+        semaphore.release()   # Hands the slot to the waiter...
+        cancelled.cancel()    # ...which is cancelled before it runs
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        await asyncio.wait_for(semaphore.acquire(1), 1)   # The slot came back
+
+    asyncio.run(scenario())
+
+
+# --- generate ---
+def test_generate_retries_retryable_errors_and_calls_before_retry():
+    model = FakeModel([ApiError(503), asyncio.TimeoutError()])
+    gemini_client.register_model("fake", model)
+    budget = []
+
+    async def before_retry():
+        budget.append(model.calls)
+
+    result = asyncio.run(gemini_client.generate("test", "hi", model="fake", before_retry=before_retry))
+    assert result == "answer to hi"
+    assert model.calls == 3
+    assert budget == [1, 2]   # Once before each retry, never before the first attempt
+    assert not gemini_client._gates["fake"].breaker.failures
+
+
+def test_generate_does_not_retry_request_errors():
+    model = FakeModel([ApiError(400)])
+    gemini_client.register_model("fake", model)
+    with pytest.raises(ApiError):
+        asyncio.run(gemini_client.generate("test", "hi", model="fake"))
+    assert model.calls == 1
+    assert not gemini_client._gates["fake"].breaker.is_open
+
+
+def test_generate_gives_up_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(gemini_client, "GEMINI_MAX_ATTEMPTS", 2)
+    model = FakeModel([ApiError(429)] * 5)
+    gemini_client.register_model("fake", model)
+    with pytest.raises(ApiError):
+        asyncio.run(gemini_client.generate("test", "hi", model="fake"))
+    assert model.calls == 2
+
+
+def test_open_circuit_rejects_without_calling_the_model():
+    model = FakeModel()
+    gemini_client.register_model("fake", model)
+    breaker = gemini_client._gate("fake").breaker
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+    assert not gemini_client.is_available("fake")
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(gemini_client.generate("test", "hi", model="fake"))
+    assert model.calls == 0
+
+
+def test_generate_raises_busy_when_no_slot_frees_up(monkeypatch):
+    monkeypatch.setattr(gemini_client, "GEMINI_MAX_IN_FLIGHT", 1)
+    monkeypatch.setattr(gemini_client, "GEMINI_INTERACTIVE_RESERVED", 0)
+
+    async def scenario():
+        hold = asyncio.Event()
+        model = FakeModel(hold=hold)
+        gemini_client.register_model("fake", model)
+        holder = asyncio.create_task(gemini_client.generate("test", "first", model="fake"))
+        await asyncio.sleep(0)
+        with pytest.raises(GeminiBusyError):
+            await gemini_client.generate("test", "second", model="fake", deadline=0.05)
+        assert model.calls == 1   # Not retried, and the breaker is not charged for it
+        assert gemini_client._gates["fake"].breaker.failures == 0
+        hold.set()
+        assert await holder == "answer to first"
+
+    asyncio.run(scenario())
@@ -0,0 +1,79 @@
+import pytest
+
+import message_filter
+from message_filter import LOW_INFORMATION, REPEAT, MessageFilter
+
+
+def low_information(content):
+    return message_filter.is_low_information(message_filter.normalize(content))
+
+
+@pytest.mark.parametrize("content", [
+    "lol",
+    "ok",
+    "k",
+    "hahahahaha",
+    "asdfasdf",
+    "👍",
+    "😂😂😂",
+    "<:pepe:123456789012345678>",
+    "<@123456789012345678>",
+    "https://example.com/some/long/path",
+    "lol https://example.com/funny.gif",
+    "",
+])
+def test_filler_is_low_information(content):
+    assert low_information(content)
+
+
+@pytest.mark.parametrize("content", [
+    "you are all wrong about this",
+    "shut up",          # Short, but in the scorer's lexicon
+    "i hate this",
+    "the mods are being unfair again",
+])
+def test_english_sentences_pass(content):
+    assert not low_information(content)
+
+
+@pytest.mark.parametrize("content", [
+    "我很生气",          # I am very angry
+    "我恨你们",          # I hate you all
+    "我恨你",            # I hate you
+    "ふざけるな",        # Don't mess with me
+    "うるさい",          # Shut up
+    "ฉันเกลียดคุณ",       # I hate you
+])
+def test_short_cjk_and_thai_sentences_pass(content):
+    assert not low_information(content)
+
+
+@pytest.mark.parametrize("content", ["哈哈哈哈", "ははは", "好的", "好", "草"])
+def test_cjk_filler_is_low_information(content):
+    assert low_information(content)
+
+
+def test_count_words_counts_unspaced_characters():
+    assert message_filter.count_words("hello world") == 2
+    assert message_filter.count_words("我很生气") == 4
+    assert message_filter.count_words("ok 我很生气") == 5
+
+
+def test_repeats_are_rejected_per_user_within_window():
+    prefilter = MessageFilter(repeat_window=60)
+    assert prefilter.check(1, "the mods are being unfair again") is None
+    assert prefilter.check(1, "The mods  are being UNFAIR again") == REPEAT
+    assert prefilter.check(2, "the mods are being unfair again") is None   # Another user may say the same
+    assert prefilter.check(1, "lol") == LOW_INFORMATION
+    assert prefilter.stats()["passed"] == 2
+
+
+def test_score_cache_evicts_least_recently_used():
+    prefilter = MessageFilter(score_cache_size=2)
+    keys = [message_filter.content_key(f"message {i}") for i in range(3)]
+    prefilter.store_scores(keys[0], {"agitation": 0.1})
+    prefilter.store_scores(keys[1], {"agitation": 0.2})
+    assert prefilter.cached_scores(keys[0]) == {"agitation": 0.1}
+    prefilter.store_scores(keys[2], {"agitation": 0.3})
+    assert prefilter.cached_scores(keys[1]) is None
+    assert prefilter.cached_scores(keys[0]) is not None
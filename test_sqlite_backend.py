@@ -0,0 +1,127 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import database_utils
+from sqlite_backend import SQLiteBackend
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "sai.db")
+
+
+@pytest.fixture
+def backend(db_path):
+    backend = SQLiteBackend(db_path, commit_interval=3600, commit_every=1000)
+    yield backend
+    backend.close()
+
+
+@pytest.fixture
+def storage(backend, fresh_database_utils):
+    """database_utils on a fresh SQLite backend, with its module state reset."""
+    database_utils.init_db(backend)
+    return backend
+
+
+def committed_count(db_path, user_id) -> int | None:
+    """message_count as seen by another connection, i.e. only what has been committed."""
+    with sqlite3.connect(db_path) as conn:
+        row = conn.execute("SELECT message_count FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+    return row[0] if row else None
+
+
+# --- SQLiteBackend ---
+def test_increment_message_counts_updates_user_member_and_guild(backend):
+    pending = {("1", "10"): 3, ("2", "10"): 2, ("1", "20"): 1}
+    backend.increment_message_counts(pending)
+    assert pending == {}
+    assert backend.get_user_profile(1)["message_count"] == 4
+    members = backend.get_member_stats(10, [1, 2, 3])
+    assert {user_id: member["message_count"] for user_id, member in members.items()} == {"1": 3, "2": 2}
+    assert backend.get_guild_totals(10) == {"message_count": 5, "analysis_count": 0}
+
+
+def test_add_user_analysis_accumulates_sums(backend):
+    backend.add_user_analysis(1, {"agitation": 0.5, "positivity": 1.0}, 2, guild_id=10)
+    backend.add_user_analysis(1, {"agitation": 0.25}, 1, guild_id=10)
+    profile = backend.get_user_profile(1)
+    assert profile["analysis_count"] == 3
+    assert profile["analysis_sums"]["agitation"] == pytest.approx(0.75)
+    assert backend.get_guild_totals(10)["analysis_count"] == 3
+
+
+def test_writes_are_committed_by_count(db_path):
+    backend = SQLiteBackend(db_path, commit_interval=3600, commit_every=2)
+    backend.increment_message_counts({("1", "10"): 1})
+    assert committed_count(db_path, 1) is None       # Buffered in the open transaction
+    assert backend.get_user_profile(1)["message_count"] == 1   # Same connection sees it
+    backend.increment_message_counts({("1", "10"): 1})
+    assert committed_count(db_path, 1) == 2
+    backend.close()
+
+
+def test_commit_makes_buffered_writes_durable(backend, db_path):
+    backend.increment_message_counts({("1", "10"): 1})
+    assert committed_count(db_path, 1) is None
+    backend.commit()
+    assert committed_count(db_path, 1) == 1
+
+
+# --- Write-behind flush through database_utils ---
+def test_flush_writes_buffered_increments_once(storage, db_path):
+    async def scenario():
+        for _ in range(5):
+            await database_utils.update_message_count(1, 10)
+        await database_utils.update_message_count(2, 10)
+        assert database_utils.pending_message_count_increments() == 6
+        assert storage.get_user_profile(1) is None
+        assert (await database_utils.get_user_profile(1))["message_count"] == 5   # Reads include the buffer
+
+        assert await database_utils.flush_message_counts() == 6
+        assert await database_utils.flush_message_counts() == 0
+        await database_utils.commit()
+
+    asyncio.run(scenario())
+    assert committed_count(db_path, 1) == 5
+    assert committed_count(db_path, 2) == 1
+    assert database_utils._dirty_members == {"10": {"1", "2"}}
+
+
+def test_failed_flush_keeps_increments_for_the_next_attempt(storage, monkeypatch):
+    calls = []
+    original = storage.increment_message_counts
+
+    def flaky(pending):
+        calls.append(dict(pending))
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        original(pending)
+
+    monkeypatch.setattr(storage, "increment_message_counts", flaky)
+
+    async def scenario():
+        await database_utils.update_message_count(1, 10)
+        await database_utils.update_message_count(1, 10)
+        with pytest.raises(sqlite3.OperationalError):
+            await database_utils.flush_message_counts()
+        assert database_utils.pending_message_count_increments() == 2
+        await database_utils.update_message_count(1, 10)
+        assert await database_utils.flush_message_counts() == 3
+
+    asyncio.run(scenario())
+    assert calls[1] == {("1", "10"): 3}
+    assert storage.get_user_profile(1)["message_count"] == 3
+    assert database_utils._dirty_members == {"10": {"1"}}
+
+
+def test_shutdown_flushes_and_commits(storage, db_path):
+    async def scenario():
+        database_utils.start_message_count_flusher()
+        await database_utils.update_message_count(1, 10)
+        await database_utils.shutdown()
+
+    asyncio.run(scenario())
+    assert committed_count(db_path, 1) == 1